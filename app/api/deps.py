@@ -2,7 +2,7 @@
 
 from app.services.interfaces import IMoodleService, IWhatsAppService
 from app.services.moodle_service import MoodleService
-from app.services.whatsapp_service import WhatsAppService # (Debes crear este archivo similar a MoodleService)
+from app.services.twilio_transport import twilio_transport
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
@@ -21,8 +21,8 @@ def get_moodle_service() -> IMoodleService:
     return MoodleService()
 
 def get_whatsapp_service() -> IWhatsAppService:
-    # Asumimos que WhatsAppService está implementado
-    return WhatsAppService()
+    # Transporte de Twilio compartido (pool de conexiones keep-alive)
+    return twilio_transport
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_chatbot_db)):
     credentials_exception = HTTPException(
@@ -1,14 +1,57 @@
 # app/api/routers/courses.py
 
-from fastapi import APIRouter, Depends
+from datetime import date
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 
-from app.db.session import get_moodle_db
+from app.core.config import settings
+from app.db.session import get_chatbot_db, get_moodle_analytics_db
 from app.crud import course_queries
+from app.services import risk_scoring
 
 router = APIRouter()
 
 @router.get("/courses/rankings")
-def get_course_rankings_api(moodle_db: Session = Depends(get_moodle_db)):
-    """Endpoint para obtener los rankings de cursos."""
-    return course_queries.get_course_rankings(moodle_db)
\ No newline at end of file
+def get_course_rankings_api(
+    limit: int = Query(course_queries.RANKING_SIZE, ge=1, le=course_queries.RANKING_MAX_SIZE),
+    offset: int = Query(0, ge=0),
+    category_id: Optional[int] = None,
+    start_from: Optional[date] = None,
+    start_to: Optional[date] = None,
+    chatbot_db: Session = Depends(get_chatbot_db),
+):
+    """
+    Endpoint para obtener los rankings de cursos (desde course_grade_stats,
+    que se actualiza junto con el snapshot de KPIs).
+    """
+    return course_queries.get_course_rankings(
+        chatbot_db,
+        limit=limit,
+        offset=offset,
+        category_id=category_id,
+        start_from=start_from,
+        start_to=start_to,
+    )
+
+
+@router.get("/courses/at-risk")
+def get_at_risk_students_api(
+    course_id: Optional[List[int]] = Query(None),
+    limit: int = Query(50, ge=1, le=1000),
+    min_score: float = Query(0.0, ge=0.0, le=1.0),
+    moodle_db: Session = Depends(get_moodle_analytics_db),
+    chatbot_db: Session = Depends(get_chatbot_db),
+):
+    """
+    Endpoint para obtener los alumnos en riesgo de una cohorte (uno o más 'course_id';
+    por defecto TARGET_COURSE_ID), ordenados por puntaje de riesgo.
+    """
+    return risk_scoring.get_at_risk_students(
+        moodle_db,
+        chatbot_db,
+        course_id or [settings.TARGET_COURSE_ID],
+        limit=limit,
+        min_score=min_score,
+    )
@@ -1,12 +1,13 @@
 # app/api/routers/crm.py
 
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
 from datetime import date
 
 from app.db.session import get_chatbot_db, get_moodle_db
 from app.crud import crm_queries
+from app.db.fanout import QueryDeadlineExceeded
 from app.api.deps import get_current_user
 from pydantic import BaseModel
 
@@ -25,13 +26,34 @@ def get_crm_messages(
     db: Session = Depends(get_chatbot_db),
     moodle_db: Session = Depends(get_moodle_db)
 ):
-    """Obtiene los mensajes para el CRM, agrupados por estudiante."""
-    return crm_queries.get_grouped_messages(db, filters, moodle_db)
+    """
+    Obtiene los mensajes para el CRM, agrupados por estudiante y paginados.
+    Para pedir la página siguiente, enviar el 'next_cursor' recibido como 'cursor'.
+    """
+    try:
+        return crm_queries.get_grouped_messages(db, filters, moodle_db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueryDeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
 @router.get("/crm/conversation/{student_phone}")
-def get_student_conversation(student_phone: str, db: Session = Depends(get_chatbot_db)):
-    """Obtiene el historial de conversación para un estudiante específico."""
-    return crm_queries.get_conversation(db, student_phone=student_phone)
+def get_student_conversation(
+    student_phone: str,
+    limit: int = Query(crm_queries.CONVERSATION_PAGE_SIZE, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: Session = Depends(get_chatbot_db)
+):
+    """
+    Obtiene el historial de conversación para un estudiante específico, paginado.
+    Sin cursores devuelve los mensajes más recientes; 'before=next_cursor' trae
+    los anteriores y 'after=newer_cursor' los que llegaron después.
+    """
+    try:
+        return crm_queries.get_conversation(db, student_phone=student_phone, limit=limit, before=before, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/crm/students/{student_phone}/actions")
 def create_student_action(
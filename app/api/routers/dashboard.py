@@ -4,21 +4,20 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 
-from app.db.session import get_chatbot_db, get_moodle_db
-from app.crud import crud_operations, moodle_queries
+from app.db.session import get_chatbot_db
+from app.crud import crud_operations, kpi_queries
 from app.schemas.kpi import KpiData
 from app.schemas.message import MessageInDB # Asumiendo que MessageInDB está bien definido
 
 router = APIRouter()
 
 @router.get("/kpis", response_model=KpiData)
-def read_kpis(
-    moodle_db: Session = Depends(get_moodle_db),
-    chatbot_db: Session = Depends(get_chatbot_db) # <-- Añadimos la segunda DB
-):
-    """Endpoint para obtener los KPIs."""
-    # Pasamos ambas sesiones a la función
-    kpi_data = moodle_queries.get_kpi_data(moodle_db=moodle_db, chatbot_db=chatbot_db)
+def read_kpis(chatbot_db: Session = Depends(get_chatbot_db)):
+    """
+    Endpoint para obtener los KPIs. Los de Moodle salen de kpi_snapshot,
+    que se actualiza en segundo plano (ver 'snapshot_age_seconds').
+    """
+    kpi_data = kpi_queries.get_kpi_data(chatbot_db)
     return kpi_data
 
 
@@ -1,7 +1,7 @@
 
 # app/api/routers/messages.py
 
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, HTTPException
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
 from datetime import date
@@ -26,5 +26,11 @@ def get_filtered_messages(
     filters: Dict[str, Any] = Body(...),
     db: Session = Depends(get_chatbot_db)
 ):
-    """Obtiene los datos de la tabla de mensajes con filtros."""
-    return messages_queries.get_filtered_messages(db, filters)
+    """
+    Obtiene los datos de la tabla de mensajes con filtros, paginados.
+    Para pedir la página siguiente, enviar el 'next_cursor' recibido como 'cursor'.
+    """
+    try:
+        return messages_queries.get_filtered_messages(db, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
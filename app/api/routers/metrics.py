@@ -0,0 +1,26 @@
+# app/api/routers/metrics.py
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from app.crud.outbox_queries import get_outbox_stats
+from app.db.session import get_chatbot_db, get_pool_stats
+from app.services.inbound_queue import inbound_queue
+from app.services.outbox_sender import outbox_sender
+
+router = APIRouter()
+
+@router.get("/metrics/inbound-queue")
+def get_inbound_queue_metrics():
+    """Largo de la cola de entrada del webhook y latencias de procesamiento."""
+    return inbound_queue.stats()
+
+@router.get("/metrics/outbox")
+def get_outbox_metrics(chatbot_db: Session = Depends(get_chatbot_db)):
+    """Mensajes del outbox por estado y antigüedad del pendiente más viejo."""
+    return {"sender_running_in_app": outbox_sender.running, **get_outbox_stats(chatbot_db)}
+
+@router.get("/metrics/db-pools")
+def get_db_pool_metrics():
+    """Conexiones en uso y tiempos de espera del checkout de cada pool (chatbot y Moodle por carga)."""
+    return get_pool_stats()
@@ -1,35 +1,37 @@
 # app/api/routers/notifications.py
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from twilio.rest import Client
 
 from app.db.session import get_chatbot_db, get_moodle_db
 from app.core.config import settings
-from app.crud import crud_operations, moodle_queries
+from app.crud import crud_operations, directory_queries, moodle_queries
 from app.schemas import message as message_schema
 from app.schemas.notification import NotificationRequest # Crearemos este schema si no existe
+from app.services.twilio_transport import twilio_transport
 
 router = APIRouter()
 
-twilio_client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-
 @router.post("/send-grade")
-def send_grade_notification(
+async def send_grade_notification(
     request: NotificationRequest,
     chatbot_db: Session = Depends(get_chatbot_db),
     moodle_db: Session = Depends(get_moodle_db),
 ):
     """
     Inicia una notificación proactiva para enviar la nota a un alumno específico.
+    Las consultas corren en el threadpool y el envío a Twilio es asíncrono.
+    El mensaje y el estado de la conversación se guardan antes de responder, así
+    una respuesta inmediata del alumno ya encuentra la conversación actualizada.
     """
     moodle_user_id = request.moodle_user_id
 
-    student_phone = moodle_queries.get_phone_by_moodle_id(chatbot_db, moodle_user_id=moodle_user_id)
+    student_phone = await run_in_threadpool(directory_queries.get_phone_by_moodle_id, chatbot_db, moodle_user_id=moodle_user_id)
     if not student_phone:
         raise HTTPException(status_code=404, detail=f"No se encontró el número de teléfono para el usuario de Moodle con ID {moodle_user_id}")
 
-    final_grade = moodle_queries.get_final_grade(moodle_db, user_id=moodle_user_id)
+    final_grade = await run_in_threadpool(moodle_queries.get_final_grade, moodle_db, user_id=moodle_user_id)
     if final_grade is None:
         raise HTTPException(status_code=404, detail=f"No se encontró una nota final para el usuario de Moodle con ID {moodle_user_id}")
 
@@ -38,13 +40,28 @@ def send_grade_notification(
     else:
         reply_text = f"Hola, te informamos que tu nota final del curso es {final_grade}. Contacta a un tutor para revisar tus opciones."
 
+    outgoing_message = message_schema.MessageCreate(
+        sender_id=settings.TWILIO_FROM_NUMBER,
+        to_id=student_phone,
+        message_body=reply_text,
+        direction='outgoing',
+    )
+    if settings.OUTBOX_ENABLED:
+        # Solo un insert local: el envío lo hace el worker del outbox
+        outbox_id = await run_in_threadpool(crud_operations.queue_outgoing_message, chatbot_db, outgoing_message, student_phone)
+        return {"status": "queued", "detail": f"Mensaje para {student_phone} encolado", "outbox_id": outbox_id}
+
     try:
-        outgoing_twilio_message = twilio_client.messages.create(
-            from_=settings.TWILIO_FROM_NUMBER, body=reply_text, to=student_phone
-        )
-        outgoing_message = message_schema.MessageCreate(sender_id=settings.TWILIO_FROM_NUMBER, message_body=reply_text, direction='outgoing')
-        crud_operations.create_message(chatbot_db, message=outgoing_message)
+        sid = await twilio_transport.send_async(to=student_phone, body=reply_text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al enviar mensaje vía Twilio: {str(e)}")
 
-        return {"status": "success", "detail": f"Mensaje enviado a {student_phone}", "sid": outgoing_twilio_message.sid}
+    # Mensaje y estado de la conversación en una sola transacción, antes de responder
+    try:
+        await run_in_threadpool(crud_operations.record_webhook_turn, chatbot_db, outgoing=outgoing_message)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al enviar mensaje vía Twilio: {str(e)}")
\ No newline at end of file
+        # El mensaje ya salió: no se informa como error para que no se reenvíe
+        chatbot_db.rollback()
+        print(f"❌ Mensaje enviado a {student_phone} pero no se pudo guardar: {e}")
+
+    return {"status": "success", "detail": f"Mensaje enviado a {student_phone}", "sid": sid}
\ No newline at end of file
@@ -16,16 +16,85 @@ class Settings(BaseSettings):
     MOODLE_DB_HOST: str
     MOODLE_DB_PORT: int
     MOODLE_DB_NAME: str
+    # Driver de los pools interactive y analytics. El pool batch (campañas, extracciones
+    # en streaming) usa siempre pymysql, que soporta cursores del lado del servidor.
+    MOODLE_DB_DRIVER: str = "mysqlconnector"
+    # Réplica de lectura opcional para el pool 'analytics'
+    MOODLE_REPLICA_HOST: str | None = None
+    # Pools de Moodle por tipo de carga (ver app/db/session.py). STATEMENT_TIMEOUT_MS es el
+    # max_execution_time de cada conexión y READ_TIMEOUT_SECONDS el del socket (0 = sin límite)
+    MOODLE_POOL_INTERACTIVE_SIZE: int = 10
+    MOODLE_POOL_INTERACTIVE_OVERFLOW: int = 10
+    MOODLE_POOL_INTERACTIVE_CHECKOUT_TIMEOUT_SECONDS: float = 5.0
+    MOODLE_POOL_INTERACTIVE_STATEMENT_TIMEOUT_MS: int = 3000
+    MOODLE_POOL_INTERACTIVE_READ_TIMEOUT_SECONDS: int = 10
+    MOODLE_POOL_ANALYTICS_SIZE: int = 3
+    MOODLE_POOL_ANALYTICS_OVERFLOW: int = 2
+    MOODLE_POOL_ANALYTICS_CHECKOUT_TIMEOUT_SECONDS: float = 30.0
+    MOODLE_POOL_ANALYTICS_STATEMENT_TIMEOUT_MS: int = 60000
+    MOODLE_POOL_ANALYTICS_READ_TIMEOUT_SECONDS: int = 90
+    MOODLE_POOL_BATCH_SIZE: int = 2
+    MOODLE_POOL_BATCH_OVERFLOW: int = 2
+    MOODLE_POOL_BATCH_CHECKOUT_TIMEOUT_SECONDS: float = 60.0
+    MOODLE_POOL_BATCH_STATEMENT_TIMEOUT_MS: int = 0
+    MOODLE_POOL_BATCH_READ_TIMEOUT_SECONDS: int = 0
     TARGET_COURSE_ID: int
 
+    # Directorio local de alumnos (ver scripts/sync_student_directory.py).
+    # Si un teléfono no está en el directorio, se busca en Moodle.
+    STUDENT_DIRECTORY_FALLBACK: bool = True
+
     # Twilio
     TWILIO_ACCOUNT_SID: str
     TWILIO_AUTH_TOKEN: str
     TWILIO_FROM_NUMBER: str
     TWILIO_MESSAGING_SERVICE_SID: str | None = None
+    # Transporte de salida: 'twilio' (API real) o 'fake' (backend local, para pruebas de carga)
+    TWILIO_TRANSPORT: str = "twilio"
+    TWILIO_API_BASE_URL: str = "https://api.twilio.com"
+    TWILIO_MAX_CONNECTIONS: int = 20
+    TWILIO_MAX_IN_FLIGHT: int = 20 # Tope de envíos en curso, entre el cliente síncrono y el asíncrono
+    TWILIO_TIMEOUT_SECONDS: float = 10.0
+    TWILIO_FAKE_LATENCY_MS: int = 150
 
     WHATSAPP_VERIFY_TOKEN: str
 
+    # Campañas de notificación: tope de envíos por segundo (token bucket) e hilos de envío
+    CAMPAIGN_RATE_PER_SECOND: float = 5.0
+    CAMPAIGN_BURST: int = 10
+    CAMPAIGN_WORKERS: int = 8
+
+    # Webhook: si está activo, responde a Twilio apenas guarda el mensaje
+    # y el resto del procesamiento corre en la cola de entrada
+    WEBHOOK_FAST_ACK: bool = False
+    INBOUND_WORKERS: int = 4
+    INBOUND_QUEUE_DEPTH: int = 500
+
+    # Registro en lotes de los mensajes de las campañas: un lote que falla se reintenta
+    # MESSAGE_LOG_MAX_RETRIES veces; después se guarda fila por fila y las que siguen
+    # fallando se descartan (con log). El buffer no pasa de MESSAGE_LOG_MAX_BUFFER mensajes.
+    MESSAGE_LOG_MAX_RETRIES: int = 3
+    MESSAGE_LOG_MAX_BUFFER: int = 10000
+
+    # Outbox: el webhook y /send-grade solo guardan el mensaje como pendiente
+    # y un worker lo envía a Twilio (en la app o con scripts/run_outbox_sender.py)
+    OUTBOX_ENABLED: bool = False
+    OUTBOX_SENDER_IN_APP: bool = True
+    OUTBOX_BATCH_SIZE: int = 50
+    OUTBOX_CONCURRENCY: int = 8
+    OUTBOX_POLL_SECONDS: float = 1.0
+    OUTBOX_MAX_ATTEMPTS: int = 5
+
+    # Cada cuántos segundos la app actualiza message_daily_stats (0 = solo con scripts/refresh_message_stats.py)
+    MESSAGE_STATS_REFRESH_SECONDS: int = 300
+    # Cada cuántos segundos la app recalcula el snapshot de KPIs de Moodle (0 = solo con scripts/refresh_kpi_snapshot.py)
+    KPI_SNAPSHOT_REFRESH_SECONDS: int = 300
+
+    # Consultas en paralelo a la DB del chatbot y a la de Moodle (app/db/fanout.py):
+    # hilos del pool y deadline por consulta (max_execution_time de MySQL)
+    DB_FANOUT_WORKERS: int = 16
+    DB_QUERY_TIMEOUT_SECONDS: float = 5.0
+
     # --- AÑADE ESTAS TRES LÍNEAS PARA JWT ---
     SECRET_KEY: str
     ALGORITHM: str
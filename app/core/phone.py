@@ -0,0 +1,22 @@
+# app/core/phone.py
+
+import re
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(raw: str | None) -> str | None:
+    """
+    Normaliza un teléfono (de Twilio 'whatsapp:+549...' o de Moodle '+54 9 11 ...')
+    a formato E.164: '+' seguido solo de dígitos.
+    """
+    if not raw:
+        return None
+    digits = _NON_DIGITS.sub("", raw)
+    return f"+{digits}" if digits else None
+
+
+def phone_key(raw: str | None) -> str | None:
+    """Clave de búsqueda: los últimos 9 dígitos del teléfono (sin prefijos de país/área)."""
+    e164 = normalize_phone(raw)
+    return e164[1:][-9:] if e164 else None
@@ -0,0 +1,66 @@
+# app/crud/campaign_queries.py
+
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy.orm import Session
+from sqlalchemy import text, bindparam
+from typing import Dict, Any, List, Set, Tuple
+
+LedgerKey = Tuple[int, int, int, Decimal]
+
+
+def ledger_key(grade_info: Dict[str, Any]) -> LedgerKey:
+    """Clave de una nota notificada: (alumno, curso, ítem de calificación, valor de la nota)."""
+    grade_value = Decimal(str(grade_info["finalgrade"])).quantize(Decimal("0.00001"))
+    return (grade_info["user_id"], grade_info["course_id"], grade_info["grade_item_id"], grade_value)
+
+
+def get_notified_keys(db: Session, keys: List[LedgerKey]) -> Set[LedgerKey]:
+    """Devuelve cuáles de las claves ya fueron notificadas (una sola consulta por lote)."""
+    if not keys:
+        return set()
+
+    query = text("""
+        SELECT moodle_user_id, course_id, grade_item_id, grade_value
+        FROM notification_ledger
+        WHERE grade_item_id IN :grade_item_ids
+          AND moodle_user_id IN :user_ids
+    """).bindparams(bindparam("grade_item_ids", expanding=True), bindparam("user_ids", expanding=True))
+    params = {
+        "grade_item_ids": list({key[2] for key in keys}),
+        "user_ids": list({key[0] for key in keys}),
+    }
+    rows = db.execute(query, params).all()
+    wanted = set(keys)
+    notified = {(row[0], row[1], row[2], Decimal(str(row[3])).quantize(Decimal("0.00001"))) for row in rows}
+    return notified & wanted
+
+
+def record_notification(db: Session, key: LedgerKey, status: str) -> None:
+    """Registra una nota como notificada. No hace commit."""
+    record_notifications(db, [(key, status)])
+
+
+def record_notifications(db: Session, entries: List[Tuple[LedgerKey, str]]) -> None:
+    """Registra varias notas como notificadas con un insert de varias filas. No hace commit."""
+    if not entries:
+        return
+    query = text("""
+        INSERT IGNORE INTO notification_ledger
+            (moodle_user_id, course_id, grade_item_id, grade_value, status, notified_at)
+        VALUES
+            (:moodle_user_id, :course_id, :grade_item_id, :grade_value, :status, :notified_at)
+    """)
+    # Solo parámetros en VALUES, así el driver lo envía como un único INSERT de varias filas
+    notified_at = datetime.utcnow()
+    db.execute(query, [
+        {
+            "moodle_user_id": key[0],
+            "course_id": key[1],
+            "grade_item_id": key[2],
+            "grade_value": key[3],
+            "status": status,
+            "notified_at": notified_at,
+        }
+        for key, status in entries
+    ])
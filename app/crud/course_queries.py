@@ -1,44 +1,147 @@
 # app/crud/course_queries.py
 
+from datetime import date, datetime, time, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
+from typing import Dict, Any
+from app.crud import moodle_queries
+from app.crud.crud_operations import get_sync_cursor, set_sync_cursor
 
 
-def get_course_rankings(moodle_db: Session) -> dict:
+STATS_CURSOR_NAME = "course_grade_stats"
+# Se vuelve a mirar este margen antes de la marca de agua: una nota escrita por una
+# transacción lenta puede llegar con un timemodified anterior al último leído
+STATS_OVERLAP_SECONDS = 300
+
+RANKING_SIZE = 10
+RANKING_MAX_SIZE = 100
+# Solo entran al ranking los cursos con más de 5 alumnos calificados
+RANKING_MIN_GRADED = 6
+
+
+def refresh_course_grade_stats(moodle_db: Session, chatbot_db: Session, full: bool = False, batch_size: int = 200) -> int:
     """
-    Calcula el ratio de aprobación de cada curso y devuelve los
-    Top 10 con mayor y menor aprobación.
+    Recalcula course_grade_stats solo para los cursos con notas finales modificadas
+    desde la marca de agua (gg.timemodified). Cada curso se recuenta completo, así un
+    cambio de nota (aprobado -> desaprobado) no se cuenta dos veces.
+    Con full=True recalcula todos los cursos y borra los que ya no tienen notas.
+    Devuelve la cantidad de cursos recalculados.
     """
-    # Consulta SQL que calcula el ratio de aprobación por curso
-    query = text("""
-        SELECT
-            c.id AS course_id,
-            c.fullname AS course_name,
-            -- Calculamos el porcentaje de aprobados
-            (SUM(CASE WHEN gg.finalgrade >= 6.0 THEN 1 ELSE 0 END) * 100.0 / COUNT(gg.id)) AS approval_rate
-        FROM
-            mdl_course c
-        JOIN
-            mdl_grade_items gi ON c.id = gi.courseid
-        JOIN
-            mdl_grade_grades gg ON gi.id = gg.itemid
-        WHERE
-            gi.itemtype = 'course' AND gg.finalgrade IS NOT NULL
-        GROUP BY
-            c.id, c.fullname
-        HAVING 
-            COUNT(gg.id) > 5 -- Opcional: solo incluir cursos con más de 5 alumnos calificados
+    # DATETIME guarda segundos: sin microsegundos, lo recalculado en este mismo segundo no se borra
+    started_at = datetime.utcnow().replace(microsecond=0)
+    last_timemodified = 0 if full else (get_sync_cursor(chatbot_db, STATS_CURSOR_NAME) or (0, 0))[0]
+    since = max(last_timemodified - STATS_OVERLAP_SECONDS, 0)
+    course_ids, max_timemodified = moodle_queries.get_courses_with_grade_changes(moodle_db, since)
+
+    upsert_query = text("""
+        INSERT INTO course_grade_stats (
+            course_id, course_name, category_id, course_startdate,
+            graded_count, approved, disapproved, grade_sum, approval_rate, refreshed_at
+        )
+        VALUES (
+            :course_id, :course_name, :category_id, :course_startdate,
+            :graded_count, :approved, :disapproved, :grade_sum, :approval_rate, :refreshed_at
+        )
+        ON DUPLICATE KEY UPDATE
+            course_name = VALUES(course_name),
+            category_id = VALUES(category_id),
+            course_startdate = VALUES(course_startdate),
+            graded_count = VALUES(graded_count),
+            approved = VALUES(approved),
+            disapproved = VALUES(disapproved),
+            grade_sum = VALUES(grade_sum),
+            approval_rate = VALUES(approval_rate),
+            refreshed_at = VALUES(refreshed_at)
     """)
+    delete_query = text("DELETE FROM course_grade_stats WHERE course_id IN :course_ids").bindparams(
+        bindparam("course_ids", expanding=True)
+    )
+    for i in range(0, len(course_ids), batch_size):
+        batch = course_ids[i:i + batch_size]
+        stats = moodle_queries.get_course_grade_stats(moodle_db, batch)
+        refreshed_at = datetime.utcnow()
+        if stats:
+            chatbot_db.execute(upsert_query, [
+                {
+                    **row,
+                    "course_startdate": row["course_startdate"] or 0,
+                    "approval_rate": row["approved"] * 100.0 / row["graded_count"] if row["graded_count"] else 0.0,
+                    "refreshed_at": refreshed_at,
+                }
+                for row in stats.values()
+            ])
+        # Cursos borrados de Moodle
+        deleted = [course_id for course_id in batch if course_id not in stats]
+        if deleted:
+            chatbot_db.execute(delete_query, {"course_ids": deleted})
+
+    if full:
+        chatbot_db.execute(text("DELETE FROM course_grade_stats WHERE refreshed_at < :started_at"), {"started_at": started_at})
+    set_sync_cursor(chatbot_db, STATS_CURSOR_NAME, max(max_timemodified, last_timemodified), 0)
+    chatbot_db.commit()
+    return len(course_ids)
 
-    results = moodle_db.execute(query).mappings().all()
 
-    # Ordenamos los resultados en Python
-    sorted_courses = sorted(results, key=lambda x: x['approval_rate'], reverse=True)
+def get_course_rankings(
+    chatbot_db: Session,
+    limit: int = RANKING_SIZE,
+    offset: int = 0,
+    category_id: int | None = None,
+    start_from: date | None = None,
+    start_to: date | None = None,
+) -> Dict[str, Any]:
+    """
+    Devuelve los cursos con mayor y menor ratio de aprobación desde course_grade_stats
+    (ORDER BY ... LIMIT sobre el índice de approval_rate), paginados con limit/offset.
+    Filtros opcionales: categoría de Moodle y rango de fecha de inicio del curso
+    (start_from inclusive, start_to inclusive).
+    """
+    limit = min(limit, RANKING_MAX_SIZE)
+    where = ["graded_count >= :min_graded"]
+    params: Dict[str, Any] = {"min_graded": RANKING_MIN_GRADED, "limit": limit, "offset": offset}
+
+    if category_id is not None:
+        where.append("category_id = :category_id")
+        params["category_id"] = category_id
+    if start_from:
+        where.append("course_startdate >= :start_from")
+        params["start_from"] = int(datetime.combine(start_from, time.min).timestamp())
+    if start_to:
+        where.append("course_startdate < :start_to")
+        params["start_to"] = int(datetime.combine(start_to + timedelta(days=1), time.min).timestamp())
+
+    where_sql = " AND ".join(where)
+    ranking_sql = f"""
+        SELECT
+            course_id,
+            course_name,
+            category_id,
+            graded_count,
+            approval_rate,
+            grade_sum / graded_count AS mean_grade,
+            refreshed_at
+        FROM course_grade_stats
+        WHERE {where_sql}
+        ORDER BY approval_rate {{direction}}, course_id {{direction}}
+        LIMIT :limit OFFSET :offset
+    """
 
-    top_10_approved = sorted_courses[:10]
-    top_10_disapproved = sorted(results, key=lambda x: x['approval_rate'])[:10]
+    def ranking(direction: str) -> list:
+        rows = chatbot_db.execute(text(ranking_sql.format(direction=direction)), params).mappings().all()
+        return [
+            {
+                **row,
+                "approval_rate": round(float(row["approval_rate"]), 2),
+                "mean_grade": round(float(row["mean_grade"]), 2),
+            }
+            for row in rows
+        ]
 
+    total = chatbot_db.execute(text(f"SELECT COUNT(*) FROM course_grade_stats WHERE {where_sql}"), params).scalar()
     return {
-        "top_approved": top_10_approved,
-        "top_disapproved": top_10_disapproved
-    }
\ No newline at end of file
+        "top_approved": ranking("DESC"),
+        "top_disapproved": ranking("ASC"),
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+    }
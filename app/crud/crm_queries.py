@@ -2,71 +2,155 @@
 
 from sqlalchemy.orm import Session
 from app.models.message import Message, CaseAction, ActionNote
-from sqlalchemy import func, desc, or_, text
+from sqlalchemy import func, desc, or_, text, bindparam
 from typing import Dict, Any, List, Optional
-from app.crud import moodle_queries # Import moodle_queries
+from app.crud import moodle_queries, directory_queries
 import collections
 from datetime import datetime
 from app.core.config import settings
-import re
+from app.core.phone import normalize_phone
+from app.crud.pagination import encode_cursor, decode_cursor
+from app.db.fanout import fan_out
 
-TEMPLATE_SIDS = {
-    "PASSED": "HXd4eaa70446b9fa2998717a0881553efd",
-    "FAILED": "HXdf67b79ece430528680858878b6a269a",
-    "ABSENT": "HX5841cadee3381b3b5ced40b5a068b5db",
-}
+CRM_PAGE_SIZE = 50
+CRM_MAX_PAGE_SIZE = 200
 
-def get_grouped_messages(db: Session, filters: Dict[str, Any], moodle_db: Session):
+def get_student_phone_page(db: Session, filters: Dict[str, Any], limit: int, cursor: Optional[str]) -> tuple[List[tuple], Optional[str]]:
     """
-    Obtiene los mensajes agrupados por estudiante (nombre completo) para el CRM.
-    Para cada estudiante, devuelve todos los mensajes y las acciones del caso.
+    Devuelve una página de teléfonos de estudiantes ordenada por última actividad
+    (más reciente primero) y el cursor de la página siguiente.
+    Agrupa por counterparty_phone (índice counterparty_phone, timestamp) con paginación
+    por clave sobre (last_timestamp, phone); el filtro de nombre se resuelve en el
+    directorio antes de paginar. Los teléfonos se devuelven normalizados (E.164).
     """
-    # 1. Obtener todos los mensajes (o un subconjunto filtrado por fecha)
-    base_query = db.query(Message)
+    params: Dict[str, Any] = {"limit": limit + 1}
+    where = ["counterparty_phone IS NOT NULL"]
+    if filters.get("start_date"):
+        where.append("timestamp >= :start_date")
+        params["start_date"] = filters["start_date"]
+    if filters.get("end_date"):
+        where.append("timestamp <= :end_date")
+        params["end_date"] = filters["end_date"]
+
+    if filters.get("student_name"):
+        # Sobre la columna sin funciones, así MySQL usa el índice de counterparty_phone
+        phones = directory_queries.get_phones_by_name(db, filters["student_name"])
+        if not phones:
+            return [], None
+        where.append("counterparty_phone IN :phones")
+        params["phones"] = phones
+
+    having = ""
+    after = decode_cursor(cursor, 2)
+    if after:
+        having = "HAVING MAX(timestamp) < :cursor_ts OR (MAX(timestamp) = :cursor_ts AND counterparty_phone < :cursor_phone)"
+        params["cursor_ts"], params["cursor_phone"] = after
+
+    query = text(f"""
+        SELECT counterparty_phone, MAX(timestamp) AS last_timestamp
+        FROM messages
+        WHERE {" AND ".join(where)}
+        GROUP BY counterparty_phone
+        {having}
+        ORDER BY last_timestamp DESC, counterparty_phone DESC
+        LIMIT :limit
+    """)
+    if "phones" in params:
+        query = query.bindparams(bindparam("phones", expanding=True))
+    rows = db.execute(query, params).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return rows, next_cursor
+
+def get_course_exam_history(db: Session, phones: List[str]) -> Dict[str, Dict[str, list]]:
+    """
+    Historial de notificaciones por curso de varios estudiantes ('phones' en E.164), con
+    una consulta agrupada sobre course_name (se guarda al enviar cada notificación).
+    Cubre todo el historial, sin los filtros de fecha de la página.
+    Devuelve {'whatsapp:+549...': {curso: [{template_id, timestamp, count}, ...]}}, con
+    una entrada por nodo enviado (la fecha del último envío) en orden cronológico.
+    """
+    history = {f"whatsapp:{phone}": collections.defaultdict(list) for phone in phones}
+    if not phones:
+        return history
+    query = text("""
+        SELECT counterparty_phone, course_name, template_id, MAX(timestamp) AS last_timestamp, COUNT(*) AS sent_count
+        FROM messages
+        WHERE counterparty_phone IN :phones AND course_name IS NOT NULL
+        GROUP BY counterparty_phone, course_name, template_id
+        ORDER BY last_timestamp
+    """).bindparams(bindparam("phones", expanding=True))
+    for row in db.execute(query, {"phones": phones}).mappings():
+        history[f"whatsapp:{row['counterparty_phone']}"][row["course_name"]].append({
+            "template_id": row["template_id"],
+            "timestamp": row["last_timestamp"].isoformat(),
+            "count": row["sent_count"],
+        })
+    return history
 
+def _load_page_messages(db: Session, phones: List[str], filters: Dict[str, Any]) -> tuple[Dict[str, list], Dict[str, list], Dict[str, Dict[str, list]]]:
+    """
+    Mensajes (en orden cronológico), acciones de caso e historial de notificaciones por
+    curso de los estudiantes de una página del CRM ('phones' en E.164), por teléfono en
+    formato de Twilio ('whatsapp:+549...').
+    Solo lee los rangos del índice (counterparty_phone, timestamp) de esos estudiantes.
+    """
+    base_query = db.query(Message).filter(Message.counterparty_phone.in_(phones))
     if filters.get("start_date"):
         base_query = base_query.filter(Message.timestamp >= filters["start_date"])
     if filters.get("end_date"):
         base_query = base_query.filter(Message.timestamp <= filters["end_date"])
 
-    all_messages = base_query.order_by(Message.timestamp.desc()).all()
+    # Hacia afuera (y en case_actions) el teléfono va en formato de Twilio: 'whatsapp:+549...'
+    messages_by_student_phone = {f"whatsapp:{phone}": [] for phone in phones}
+    for message in base_query.order_by(Message.timestamp.asc(), Message.id.asc()).all():
+        messages_by_student_phone[f"whatsapp:{message.counterparty_phone}"].append(message)
 
-    # 2. Agrupar mensajes por número de teléfono del estudiante
-    BOT_NUMBER = settings.TWILIO_FROM_NUMBER
-    messages_by_student_phone = collections.defaultdict(list)
-    student_phones = set()
+    # Acciones de caso de todos los estudiantes de la página, en tres consultas
+    actions_by_phone = load_case_actions(db, student_phones=list(messages_by_student_phone))
+    return messages_by_student_phone, actions_by_phone, get_course_exam_history(db, phones)
 
-    for message in all_messages:
-        student_phone = None
-        if message.sender_id == BOT_NUMBER:
-            student_phone = message.to_id
-        else:
-            student_phone = message.sender_id
-        
-        if student_phone:
-            messages_by_student_phone[student_phone].append(message)
-            student_phones.add(student_phone)
+def get_grouped_messages(db: Session, filters: Dict[str, Any], moodle_db: Session):
+    """
+    Obtiene los mensajes agrupados por estudiante para el CRM, paginados por
+    última actividad. Filtros: start_date, end_date, student_name, limit y cursor
+    (el 'next_cursor' de la página anterior).
+    Para cada estudiante de la página, devuelve todos sus mensajes y las acciones del caso.
+    Las consultas a Moodle y a la DB del chatbot corren en paralelo (app/db/fanout.py).
+    """
+    limit = min(int(filters.get("limit") or CRM_PAGE_SIZE), CRM_MAX_PAGE_SIZE)
 
-    # 3. Obtener nombres de estudiantes de Moodle
-    students_names_map = moodle_queries.get_students_by_phone_numbers(moodle_db, list(student_phones))
+    # 1. Una página de teléfonos de estudiantes, agrupada y ordenada en SQL
+    page, next_cursor = get_student_phone_page(db, filters, limit, filters.get("cursor"))
+    phones = [row[0] for row in page]
+    if not phones:
+        return {"students": [], "next_cursor": None}
 
-    # 4. Preparar la lista de estudiantes con todos sus mensajes y aplicar filtros
-    student_list = []
-    student_name_filter = filters.get("student_name", "").lower()
+    # 2. Nombres e IDs de Moodle del directorio local
+    students_map = directory_queries.get_students_by_phones(db, [f"whatsapp:{phone}" for phone in phones])
 
-    for student_phone, messages in messages_by_student_phone.items():
-        full_name = students_names_map.get(student_phone, f"UNKNOWN_STUDENT_{student_phone}")
+    # 3. En paralelo: las notas finales en Moodle y, en la DB del chatbot,
+    #    los mensajes y las acciones de caso de los estudiantes de la página
+    results = fan_out({
+        "page": (db, _load_page_messages, phones, filters),
+        "grades": (moodle_db, moodle_queries.get_final_grades, [student["moodle_user_id"] for student in students_map.values()]),
+    })
+    messages_by_student_phone, actions_by_phone, history_by_phone = results["page"]
+    final_grades = results["grades"]
 
-        # Aplicar filtro de nombre de estudiante en Python
-        if student_name_filter and student_name_filter not in full_name.lower():
-            continue # Skip if name doesn't match filter
+    # 4. Preparar la lista de estudiantes con todos sus mensajes
+    student_list = []
 
-        # Sort messages by timestamp ascending for chronological display
-        sorted_messages = sorted(messages, key=lambda msg: msg.timestamp)
+    for student_phone, messages in messages_by_student_phone.items():
+        student = students_map.get(student_phone)
+        full_name = student["full_name"] if student else f"UNKNOWN_STUDENT_{student_phone}"
 
-        # Extract relevant message data
+        # Extract relevant message data (already in chronological order)
         formatted_messages = []
-        for msg in sorted_messages:
+        for msg in messages:
             formatted_messages.append({
                 "id": msg.id,
                 "message_body": msg.message_body,
@@ -74,39 +158,13 @@ def get_grouped_messages(db: Session, filters: Dict[str, Any], moodle_db: Sessio
                 "sender_id": msg.sender_id,
                 "to_id": msg.to_id,
                 "direction": msg.direction,
-                "template_id": msg.template_id
+                "template_id": msg.template_id,
+                "course_name": msg.course_name
             })
 
-        actions = get_case_actions_for_student(db, student_phone) if student_phone else []
-
-        final_grade = moodle_queries.get_student_final_grade_by_phone(moodle_db, student_phone)
-        
-        course_message_exam_history = collections.defaultdict(list)
-        for msg in formatted_messages:
-            course_name = None
-            if msg["template_id"] == TEMPLATE_SIDS["PASSED"]:
-                # Example: "¡Felicitaciones, Andrea Soledad! 🎉 Vimos que has aprobado tu examen de 1 - ADMINISTRACIÓN ADM. ¡Excelente trabajo! Sigue así, estás cada vez más cerca de tu meta. 💪"
-                match = re.search(r"examen de (.*?)\. ¡Excelente trabajo!", msg["message_body"])
-                if match:
-                    course_name = match.group(1).strip()
-            elif msg["template_id"] == TEMPLATE_SIDS["FAILED"]:
-                # Example: "Hola Ana Irene Jesus. Vimos tu resultado en el examen de 1 - SISTEMAS OPERATIVOS. No te preocupes, esto es una oportunidad para reforzar los temas. Para poder ayudarte mejor, ¿podrías contarnos cuál fue el principal motivo?"
-                match = re.search(r"examen de (.*?)\. No te preocupes", msg["message_body"])
-                if match:
-                    course_name = match.group(1).strip()
-            elif msg["template_id"] == TEMPLATE_SIDS["ABSENT"]:
-                # Example: "Hola Fabio Rene, notamos que tienes pendiente el examen de 2025 - RDLS - 3° TECNOLOGÍA E IMPLEMENTACIÓN- HIDRO. Queremos asegurarnos de que todo esté bien."
-                match = re.search(r"examen de (.*?)\. Queremos asegurarnos", msg["message_body"])
-                if match:
-                    course_name = match.group(1).strip()
-
-            if course_name:
-                course_message_exam_history[course_name].append({
-                    "template_id": msg["template_id"],
-                    "timestamp": msg["timestamp"]
-                })
-        
-        print(f"Course Message Exam History for {full_name}: {course_message_exam_history}") # NEW DEBUG LINE
+        actions = actions_by_phone.get(student_phone, [])
+
+        final_grade = final_grades.get(student["moodle_user_id"]) if student else None
 
         student_list.append({
             "student_name": full_name,
@@ -114,24 +172,73 @@ def get_grouped_messages(db: Session, filters: Dict[str, Any], moodle_db: Sessio
             "messages": formatted_messages,
             "case_actions": actions,
             "final_grade": final_grade,
-            "course_message_exam_history": course_message_exam_history # NEW
+            "course_message_exam_history": history_by_phone.get(student_phone, {})
         })
-    
-    return student_list
 
-def get_conversation(db: Session, student_phone: str):
+    return {"students": student_list, "next_cursor": next_cursor}
+
+CONVERSATION_PAGE_SIZE = 50
+
+def get_conversation(
+    db: Session,
+    student_phone: str,
+    limit: int = CONVERSATION_PAGE_SIZE,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Dict[str, Any]:
     """
-    Obtiene todos los mensajes de una conversación con un estudiante.
+    Obtiene una página de la conversación con un estudiante, en orden cronológico.
+    Sin cursor devuelve los 'limit' mensajes más recientes; con 'before' los anteriores
+    a ese cursor y con 'after' los posteriores. Paginación por clave sobre (timestamp, id)
+    en el índice (counterparty_phone, timestamp): el costo no depende del largo del historial.
+    Devuelve 'next_cursor' (para pedir mensajes más viejos, o None si no hay) y
+    'newer_cursor' (para pedir los que lleguen después).
     """
-    return db.query(Message).filter(
-        or_(Message.sender_id == student_phone, Message.to_id == student_phone)
-    ).order_by(Message.timestamp.asc()).all()
+    phone = normalize_phone(student_phone)
+    if not phone:
+        return {"messages": [], "next_cursor": None, "newer_cursor": after}
+    if before and after:
+        raise ValueError("Use either 'before' or 'after', not both")
+
+    params: Dict[str, Any] = {"phone": phone, "limit": limit + 1}
+    keyset, order = "", "DESC"
+    cursor = decode_cursor(before or after, 2)
+    if cursor:
+        params["cursor_ts"], params["cursor_id"] = cursor
+        if before:
+            keyset = "AND (timestamp < :cursor_ts OR (timestamp = :cursor_ts AND id < :cursor_id))"
+        else:
+            keyset, order = "AND (timestamp > :cursor_ts OR (timestamp = :cursor_ts AND id > :cursor_id))", "ASC"
+
+    # Solo las columnas que muestra el CRM, sin instanciar objetos del ORM
+    query = text(f"""
+        SELECT id, message_body, timestamp, sender_id, to_id, direction, template_id
+        FROM messages
+        WHERE counterparty_phone = :phone {keyset}
+        ORDER BY timestamp {order}, id {order}
+        LIMIT :limit
+    """)
+    rows = db.execute(query, params).mappings().all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "DESC":
+        rows = rows[::-1]
+
+    messages = [dict(row) for row in rows]
+    oldest, newest = (messages[0], messages[-1]) if messages else (None, None)
+    # Hacia atrás hay más si la consulta descendente se pasó del límite, o si vinimos con 'after'
+    more_older = has_more if order == "DESC" else bool(cursor)
+    return {
+        "messages": messages,
+        "next_cursor": encode_cursor(oldest["timestamp"], oldest["id"]) if oldest and more_older else None,
+        "newer_cursor": encode_cursor(newest["timestamp"], newest["id"]) if newest else after,
+    }
 
 def create_case_action(db: Session, student_phone: str, action_type: str, user_id: int, message_id: Optional[int] = None) -> CaseAction:
     """
     Crea una nueva acción de caso para un estudiante, opcionalmente asociada a un mensaje.
     """
-    print(f"Received message_id: {message_id}, type: {type(message_id)}")
     db_action = CaseAction(
         student_phone=student_phone,
         message_id=message_id, # New field
@@ -159,71 +266,81 @@ def create_action_note(db: Session, action_id: int, note: str, user_id: int) ->
     db.refresh(db_note)
     return db_note
 
-def get_case_actions_for_student(db: Session, student_phone: str) -> List[Dict[str, Any]]:
+def load_case_actions(
+    db: Session,
+    student_phones: Optional[List[str]] = None,
+    message_ids: Optional[List[int]] = None,
+) -> Dict[Any, List[Dict[str, Any]]]:
     """
-    Obtiene todas las acciones de caso para un estudiante, incluyendo el nombre del usuario y las notas.
+    Carga las acciones de caso (con el nombre del usuario y sus notas) de un conjunto
+    de teléfonos o de mensajes en tres consultas: acciones, notas y usuarios.
+    Devuelve un diccionario {teléfono o message_id: [acciones]}; las claves sin acciones no aparecen.
     """
-    actions = db.query(CaseAction).filter(CaseAction.student_phone == student_phone).all()
-    
-    results = []
-    for action in actions:
-        user_query = text("SELECT username FROM crm_users WHERE id = :user_id")
-        user_result = db.execute(user_query, {"user_id": action.user_id}).first()
-        user_name = user_result[0] if user_result else "Unknown"
-        
-        notes_query = db.query(ActionNote).filter(ActionNote.action_id == action.id).order_by(ActionNote.timestamp.desc()).all()
-        notes = []
-        for note in notes_query:
-            note_user_query = text("SELECT username FROM crm_users WHERE id = :user_id")
-            note_user_result = db.execute(note_user_query, {"user_id": note.user_id}).first()
-            note_user_name = note_user_result[0] if note_user_result else "Unknown"
-            notes.append({
-                "note": note.note,
-                "user_name": note_user_name,
-                "timestamp": note.timestamp
-            })
+    if student_phones is not None:
+        key_column, keys = "student_phone", list(set(student_phones))
+    else:
+        key_column, keys = "message_id", list(set(message_ids or []))
+    if not keys:
+        return {}
+
+    # 1. Acciones del conjunto pedido
+    actions_query = text(f"""
+        SELECT id, student_phone, message_id, action_type, user_id, timestamp
+        FROM case_actions
+        WHERE {key_column} IN :keys
+        ORDER BY id
+    """).bindparams(bindparam("keys", expanding=True))
+    actions = db.execute(actions_query, {"keys": keys}).mappings().all()
+    if not actions:
+        return {}
+
+    # 2. Notas de todas esas acciones
+    notes_query = text("""
+        SELECT action_id, note, user_id, timestamp
+        FROM action_notes
+        WHERE action_id IN :action_ids
+        ORDER BY timestamp DESC
+    """).bindparams(bindparam("action_ids", expanding=True))
+    notes = db.execute(notes_query, {"action_ids": [action["id"] for action in actions]}).mappings().all()
 
-        results.append({
-            "id": action.id,
-            "action_type": action.action_type,
-            "user_name": user_name,
-            "timestamp": action.timestamp,
-            "notes": notes
+    # 3. Nombres de todos los usuarios involucrados
+    user_ids = {action["user_id"] for action in actions} | {note["user_id"] for note in notes}
+    user_ids.discard(None)
+    usernames = {}
+    if user_ids:
+        users_query = text("SELECT id, username FROM crm_users WHERE id IN :user_ids").bindparams(bindparam("user_ids", expanding=True))
+        usernames = {row[0]: row[1] for row in db.execute(users_query, {"user_ids": list(user_ids)}).all()}
+
+    notes_by_action = collections.defaultdict(list)
+    for note in notes:
+        notes_by_action[note["action_id"]].append({
+            "note": note["note"],
+            "user_name": usernames.get(note["user_id"], "Unknown"),
+            "timestamp": note["timestamp"]
+        })
+
+    results = collections.defaultdict(list)
+    for action in actions:
+        results[action[key_column]].append({
+            "id": action["id"],
+            "action_type": action["action_type"],
+            "user_name": usernames.get(action["user_id"], "Unknown"),
+            "timestamp": action["timestamp"],
+            "notes": notes_by_action.get(action["id"], [])
         })
-    return results
+    return dict(results)
+
+def get_case_actions_for_student(db: Session, student_phone: str) -> List[Dict[str, Any]]:
+    """
+    Obtiene todas las acciones de caso para un estudiante, incluyendo el nombre del usuario y las notas.
+    """
+    return load_case_actions(db, student_phones=[student_phone]).get(student_phone, [])
 
 def get_case_actions_for_message(db: Session, message_id: int) -> List[Dict[str, Any]]:
     """
     Obtiene todas las acciones de caso para un mensaje específico, incluyendo el nombre del usuario y las notas.
     """
-    actions = db.query(CaseAction).filter(CaseAction.message_id == message_id).all()
-    
-    results = []
-    for action in actions:
-        user_query = text("SELECT username FROM crm_users WHERE id = :user_id")
-        user_result = db.execute(user_query, {"user_id": action.user_id}).first()
-        user_name = user_result[0] if user_result else "Unknown"
-        
-        notes_query = db.query(ActionNote).filter(ActionNote.action_id == action.id).order_by(ActionNote.timestamp.desc()).all()
-        notes = []
-        for note in notes_query:
-            note_user_query = text("SELECT username FROM crm_users WHERE id = :user_id")
-            note_user_result = db.execute(note_user_query, {"user_id": note.user_id}).first()
-            note_user_name = note_user_result[0] if note_user_result else "Unknown"
-            notes.append({
-                "note": note.note,
-                "user_name": note_user_name,
-                "timestamp": note.timestamp
-            })
-
-        results.append({
-            "id": action.id,
-            "action_type": action.action_type,
-            "user_name": user_name,
-            "timestamp": action.timestamp,
-            "notes": notes
-        })
-    return results
+    return load_case_actions(db, message_ids=[message_id]).get(message_id, [])
 
 def get_case_action_counts(db: Session) -> Dict[str, int]:
     """
@@ -1,19 +1,20 @@
 # app/crud/crud_operations.py
 
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.models.message import Message
+from sqlalchemy import text, bindparam
+import re
+from app.models.message import Message, ConversationState
 from app.schemas.message import MessageCreate
+from app.core.phone import normalize_phone
+from app.flows import flow_manager
+from app.crud.outbox_queries import enqueue_outbound
 
 def create_message(db: Session, message: MessageCreate) -> Message:
-    db_message = Message(
-        sender_id=message.sender_id,
-        message_body=message.message_body,
-        direction=message.direction,
-        to_id=message.to_id,
-        template_id=message.template_id
-    )
+    db_message = _build_message(message)
     db.add(db_message)
+    if message.direction == 'outgoing' and message.to_id:
+        # El estado de la conversación se actualiza en la misma transacción
+        update_conversation_state(db, phone=message.to_id, template_id=message.template_id)
     db.commit()
     db.refresh(db_message)
     return db_message
@@ -33,18 +34,279 @@ def get_all_messages(db: Session, limit: int = 100) -> list:
 def get_last_outgoing_message(db: Session, to_id: str) -> Message | None:
     return db.query(Message).filter(Message.to_id == to_id, Message.direction == 'outgoing').order_by(Message.timestamp.desc()).first()
 
+def get_conversation_state(db: Session, phone: str) -> ConversationState | None:
+    """Obtiene el estado de la conversación con un teléfono (búsqueda por clave primaria)."""
+    key = normalize_phone(phone)
+    return db.get(ConversationState, key) if key else None
+
+def update_conversation_state(db: Session, phone: str, template_id: str | None, turns: int = 1) -> None:
+    """
+    Registra un mensaje saliente en el estado de la conversación: el nodo actual
+    pasa a ser el del mensaje (o ninguno) y se suman 'turns' turnos. No hace commit.
+    """
+    key = normalize_phone(phone)
+    if not key:
+        return
+    resolved = flow_manager.resolve_node(template_id)
+    flow_id, node_id = (resolved[0].get("id"), resolved[1]["id"]) if resolved else (None, None)
+    query = text("""
+        INSERT INTO conversation_states (phone, flow_id, node_id, last_activity, turn_count)
+        VALUES (:phone, :flow_id, :node_id, NOW(), :turns)
+        ON DUPLICATE KEY UPDATE
+            flow_id = VALUES(flow_id),
+            node_id = VALUES(node_id),
+            last_activity = VALUES(last_activity),
+            turn_count = turn_count + VALUES(turn_count)
+    """)
+    db.execute(query, {"phone": key, "flow_id": flow_id, "node_id": node_id, "turns": turns})
+
+def backfill_conversation_states(db: Session) -> int:
+    """
+    Reconstruye conversation_states a partir del último mensaje saliente
+    de cada teléfono en la tabla messages. Devuelve la cantidad de conversaciones.
+    """
+    query = text("""
+        SELECT m.to_id, m.template_id, m.timestamp, latest.turns
+        FROM messages m
+        JOIN (
+            SELECT to_id, MAX(id) AS last_id, COUNT(id) AS turns
+            FROM messages
+            WHERE direction = 'outgoing' AND to_id IS NOT NULL
+            GROUP BY to_id
+        ) AS latest ON m.id = latest.last_id
+    """)
+
+    # Un mismo teléfono puede figurar con distintos formatos en to_id
+    states = {}
+    for row in db.execute(query).mappings():
+        key = normalize_phone(row["to_id"])
+        if not key:
+            continue
+        previous = states.get(key)
+        turns = row["turns"] + (previous["turn_count"] if previous else 0)
+        if previous and previous["last_activity"] >= row["timestamp"]:
+            previous["turn_count"] = turns
+            continue
+        resolved = flow_manager.resolve_node(row["template_id"])
+        states[key] = {
+            "phone": key,
+            "flow_id": resolved[0].get("id") if resolved else None,
+            "node_id": resolved[1]["id"] if resolved else None,
+            "last_activity": row["timestamp"],
+            "turn_count": turns,
+        }
+
+    if states:
+        db.execute(text("""
+            INSERT INTO conversation_states (phone, flow_id, node_id, last_activity, turn_count)
+            VALUES (:phone, :flow_id, :node_id, :last_activity, :turn_count)
+            ON DUPLICATE KEY UPDATE
+                flow_id = VALUES(flow_id),
+                node_id = VALUES(node_id),
+                last_activity = VALUES(last_activity),
+                turn_count = VALUES(turn_count)
+        """), list(states.values()))
+    db.commit()
+    return len(states)
+
+# Plantillas de las notificaciones anteriores a que se guardara el curso en cada mensaje,
+# con el patrón que recupera el nombre del curso del texto enviado
+LEGACY_COURSE_PATTERNS = {
+    # "¡Felicitaciones, Andrea Soledad! 🎉 Vimos que has aprobado tu examen de 1 - ADMINISTRACIÓN ADM. ¡Excelente trabajo! ..."
+    "HXd4eaa70446b9fa2998717a0881553efd": re.compile(r"examen de (.*?)\. ¡Excelente trabajo!"),
+    # "Hola Ana Irene Jesus. Vimos tu resultado en el examen de 1 - SISTEMAS OPERATIVOS. No te preocupes, ..."
+    "HXdf67b79ece430528680858878b6a269a": re.compile(r"examen de (.*?)\. No te preocupes"),
+    # "Hola Fabio Rene, notamos que tienes pendiente el examen de 2025 - RDLS - 3° TECNOLOGÍA E IMPLEMENTACIÓN- HIDRO. Queremos asegurarnos ..."
+    "HX5841cadee3381b3b5ced40b5a068b5db": re.compile(r"examen de (.*?)\. Queremos asegurarnos"),
+}
+
+def backfill_message_courses(db: Session, resolve_course_id=None, batch_size: int = 1000) -> int:
+    """
+    Completa course_name (y course_id, si se pasa resolve_course_id) en los mensajes
+    de notificación viejos, aplicando una sola vez los patrones de LEGACY_COURSE_PATTERNS.
+    Recorre la tabla por lotes de ID y confirma cada lote. Devuelve la cantidad de mensajes actualizados.
+    """
+    select_query = text("""
+        SELECT id, template_id, message_body
+        FROM messages
+        WHERE id > :last_id
+          AND direction = 'outgoing'
+          AND course_name IS NULL
+          AND template_id IN :template_ids
+        ORDER BY id
+        LIMIT :batch_size
+    """).bindparams(bindparam("template_ids", expanding=True))
+    update_query = text("UPDATE messages SET course_name = :course_name, course_id = :course_id WHERE id = :id")
+
+    course_ids = {}
+    last_id, updated = 0, 0
+    while True:
+        rows = db.execute(select_query, {
+            "last_id": last_id,
+            "template_ids": list(LEGACY_COURSE_PATTERNS),
+            "batch_size": batch_size,
+        }).mappings().all()
+        if not rows:
+            break
+
+        updates = []
+        for row in rows:
+            match = LEGACY_COURSE_PATTERNS[row["template_id"]].search(row["message_body"] or "")
+            if not match:
+                continue
+            course_name = match.group(1).strip()
+            if resolve_course_id and course_name not in course_ids:
+                course_ids[course_name] = resolve_course_id(course_name)
+            updates.append({"id": row["id"], "course_name": course_name, "course_id": course_ids.get(course_name)})
+
+        if updates:
+            db.execute(update_query, updates)
+        db.commit()
+        updated += len(updates)
+        last_id = rows[-1]["id"]
+
+    return updated
+
+def backfill_counterparty_phones(db: Session, batch_size: int = 5000) -> int:
+    """
+    Completa counterparty_phone en los mensajes que no lo tienen, por lotes de ID
+    (confirma cada lote). Devuelve la cantidad de mensajes actualizados.
+    """
+    select_query = text("""
+        SELECT id, direction, sender_id, to_id
+        FROM messages
+        WHERE id > :last_id AND counterparty_phone IS NULL
+        ORDER BY id
+        LIMIT :batch_size
+    """)
+    update_query = text("UPDATE messages SET counterparty_phone = :counterparty_phone WHERE id = :id")
+
+    last_id, updated = 0, 0
+    while True:
+        rows = db.execute(select_query, {"last_id": last_id, "batch_size": batch_size}).mappings().all()
+        if not rows:
+            break
+        updates = [
+            {"id": row["id"], "counterparty_phone": phone}
+            for row in rows
+            if (phone := counterparty_phone(row["direction"], row["sender_id"], row["to_id"]))
+        ]
+        if updates:
+            db.execute(update_query, updates)
+        db.commit()
+        updated += len(updates)
+        last_id = rows[-1]["id"]
+
+    return updated
+
 from app.models.message import DashboardAlert # Import the new model
 from app.schemas.alert import DashboardAlertCreate # Need to create this schema
 
 def create_dashboard_alert(db: Session, alert: DashboardAlertCreate) -> DashboardAlert:
-    db_alert = DashboardAlert(
+    db_alert = _build_dashboard_alert(alert)
+    db.add(db_alert)
+    db.commit()
+    db.refresh(db_alert)
+    return db_alert
+
+def counterparty_phone(direction: str, sender_id: str | None, to_id: str | None) -> str | None:
+    """Teléfono normalizado del alumno de un mensaje: el destinatario si es saliente, si no el remitente."""
+    return normalize_phone(to_id if direction == 'outgoing' else sender_id)
+
+def message_values(message: MessageCreate) -> dict:
+    """Columnas de la tabla messages para un MessageCreate (para el ORM y para inserts masivos)."""
+    return {
+        "sender_id": message.sender_id,
+        "message_body": message.message_body,
+        "direction": message.direction,
+        "to_id": message.to_id,
+        "template_id": message.template_id,
+        "course_id": message.course_id,
+        "course_name": message.course_name,
+        "grade_item_id": message.grade_item_id,
+        "counterparty_phone": counterparty_phone(message.direction, message.sender_id, message.to_id),
+    }
+
+def _build_message(message: MessageCreate) -> Message:
+    return Message(**message_values(message))
+
+def _build_dashboard_alert(alert: DashboardAlertCreate) -> DashboardAlert:
+    return DashboardAlert(
         student_phone=alert.student_phone,
         message_id=alert.message_id,
         alert_type=alert.alert_type,
         description=alert.description,
         is_resolved=alert.is_resolved
     )
-    db.add(db_alert)
+
+def record_webhook_turn(
+    db: Session,
+    incoming: MessageCreate | None = None,
+    outgoing: MessageCreate | None = None,
+    alert: DashboardAlertCreate | None = None,
+    outbox: bool = False,
+) -> dict:
+    """
+    Guarda en una sola transacción lo que produce un mensaje del webhook:
+    el mensaje entrante, la respuesta, la alerta y el estado de la conversación.
+    Con outbox=True la respuesta además queda pendiente de envío en outbound_messages.
+    Los IDs salen del INSERT (sin SELECT de refresh) y hay un único commit.
+    Devuelve los IDs generados.
+    """
+    db_incoming = _build_message(incoming) if incoming else None
+    db_outgoing = _build_message(outgoing) if outgoing else None
+    db_alert = _build_dashboard_alert(alert) if alert else None
+    # Se agregan en orden para que el entrante quede con un ID menor que la respuesta
+    db.add_all([obj for obj in (db_incoming, db_outgoing, db_alert) if obj is not None])
+    db.flush()
+
+    if outgoing and outgoing.to_id:
+        update_conversation_state(db, phone=outgoing.to_id, template_id=outgoing.template_id)
+
+    db_outbound = None
+    if outbox and db_outgoing:
+        db_outbound = enqueue_outbound(db, to_id=outgoing.to_id, body=outgoing.message_body, message_id=db_outgoing.id)
+        db.flush()
+
+    ids = {
+        "incoming_id": db_incoming.id if db_incoming else None,
+        "outgoing_id": db_outgoing.id if db_outgoing else None,
+        "alert_id": db_alert.id if db_alert else None,
+        "outbox_id": db_outbound.id if db_outbound else None,
+    }
     db.commit()
-    db.refresh(db_alert)
-    return db_alert
+    return ids
+
+def queue_outgoing_message(db: Session, message: MessageCreate, to: str) -> int:
+    """
+    Guarda un mensaje saliente y lo deja pendiente de envío a 'to' en el outbox,
+    en una sola transacción. Devuelve el ID del outbox.
+    """
+    db_message = _build_message(message)
+    db.add(db_message)
+    db.flush()
+    if message.to_id:
+        update_conversation_state(db, phone=message.to_id, template_id=message.template_id)
+    db_outbound = enqueue_outbound(db, to_id=to, body=message.message_body, message_id=db_message.id)
+    db.flush()
+    outbox_id = db_outbound.id
+    db.commit()
+    return outbox_id
+
+def get_sync_cursor(db: Session, name: str) -> tuple[int, int] | None:
+    """Devuelve la marca de agua (timemodified, id) de un proceso incremental, o None si nunca corrió."""
+    query = text("SELECT last_timemodified, last_id FROM sync_cursors WHERE name = :name")
+    result = db.execute(query, {"name": name}).first()
+    return (result[0], result[1]) if result else None
+
+def set_sync_cursor(db: Session, name: str, last_timemodified: int, last_id: int) -> None:
+    """Guarda la marca de agua de un proceso incremental. No hace commit."""
+    query = text("""
+        INSERT INTO sync_cursors (name, last_timemodified, last_id, updated_at)
+        VALUES (:name, :last_timemodified, :last_id, UTC_TIMESTAMP())
+        ON DUPLICATE KEY UPDATE
+            last_timemodified = VALUES(last_timemodified),
+            last_id = VALUES(last_id),
+            updated_at = VALUES(updated_at)
+    """)
+    db.execute(query, {"name": name, "last_timemodified": last_timemodified, "last_id": last_id})
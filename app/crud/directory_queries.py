@@ -0,0 +1,203 @@
+# app/crud/directory_queries.py
+
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy import text, bindparam
+from typing import Dict, List, Optional
+from app.core.phone import normalize_phone, phone_key
+from app.crud import moodle_queries
+from app.crud.crud_operations import get_sync_cursor, set_sync_cursor
+
+SYNC_CURSOR_NAME = "student_directory"
+
+
+def _pick_match(rows: list, e164: str):
+    """Entre los alumnos con la misma clave, prefiere el que coincide exacto en E.164."""
+    return next((row for row in rows if row["phone_e164"] == e164), rows[0])
+
+
+def get_student_by_phone(chatbot_db: Session, phone_number: str) -> dict | None:
+    """
+    Busca un alumno en el directorio local por su teléfono (búsqueda puntual por índice).
+    Devuelve el mismo formato que moodle_queries.get_student_by_phone.
+    """
+    key = phone_key(phone_number)
+    if not key:
+        return None
+
+    query = text("""
+        SELECT moodle_user_id, phone_e164, full_name
+        FROM student_directory
+        WHERE phone_key = :phone_key
+    """)
+    rows = chatbot_db.execute(query, {"phone_key": key}).mappings().all()
+    if not rows:
+        return None
+
+    row = _pick_match(rows, normalize_phone(phone_number))
+    return {"moodle_user_id": row["moodle_user_id"], "full_name": row["full_name"]}
+
+
+def get_students_by_phone_numbers(chatbot_db: Session, phone_numbers: List[str]) -> Dict[str, str]:
+    """
+    Obtiene los nombres completos de los alumnos para una lista de teléfonos
+    con una sola consulta IN sobre el directorio local.
+    Retorna un diccionario mapeando número de teléfono (tal como llegó) a nombre completo.
+    """
+    return {phone: student["full_name"] for phone, student in get_students_by_phones(chatbot_db, phone_numbers).items()}
+
+
+def get_students_by_phones(chatbot_db: Session, phone_numbers: List[str]) -> Dict[str, dict]:
+    """
+    Como get_students_by_phone_numbers, pero devuelve el registro completo
+    ({moodle_user_id, full_name}) de cada teléfono encontrado.
+    """
+    keys = {phone: phone_key(phone) for phone in phone_numbers}
+    wanted = {key for key in keys.values() if key}
+    if not wanted:
+        return {}
+
+    query = text("""
+        SELECT moodle_user_id, phone_e164, phone_key, full_name
+        FROM student_directory
+        WHERE phone_key IN :phone_keys
+    """).bindparams(bindparam("phone_keys", expanding=True))
+    rows = chatbot_db.execute(query, {"phone_keys": list(wanted)}).mappings().all()
+
+    rows_by_key: Dict[str, list] = {}
+    for row in rows:
+        rows_by_key.setdefault(row["phone_key"], []).append(row)
+
+    students = {}
+    for phone, key in keys.items():
+        if key in rows_by_key:
+            row = _pick_match(rows_by_key[key], normalize_phone(phone))
+            students[phone] = {"moodle_user_id": row["moodle_user_id"], "full_name": row["full_name"]}
+    return students
+
+
+def find_students_by_name(chatbot_db: Session, name: str, limit: int = 500) -> list:
+    """
+    Busca alumnos cuyo nombre completo o apellido empieza con 'name'.
+    Es una búsqueda por prefijo sobre columnas indexadas (rangos de índice, sin recorrer la tabla).
+    Devuelve hasta 'limit' filas con moodle_user_id, phone_e164, phone_key y full_name.
+    """
+    name = name.strip()
+    if not name:
+        return []
+    # Los comodines que escriba el usuario se buscan literalmente
+    pattern = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    query = text("""
+        SELECT moodle_user_id, phone_e164, phone_key, full_name
+        FROM student_directory
+        WHERE full_name LIKE :pattern OR lastname LIKE :pattern
+        LIMIT :limit
+    """)
+    return chatbot_db.execute(query, {"pattern": pattern, "limit": limit}).mappings().all()
+
+
+def get_phones_by_name(chatbot_db: Session, name: str) -> List[str]:
+    """Teléfonos (E.164) de los alumnos cuyo nombre o apellido empieza con 'name'."""
+    return list({row["phone_e164"] for row in find_students_by_name(chatbot_db, name)})
+
+
+def get_phone_by_moodle_id(chatbot_db: Session, moodle_user_id: int) -> Optional[str]:
+    """Devuelve la dirección de WhatsApp ('whatsapp:+549...') de un usuario de Moodle."""
+    query = text("SELECT phone_e164 FROM student_directory WHERE moodle_user_id = :moodle_user_id")
+    result = chatbot_db.execute(query, {"moodle_user_id": moodle_user_id}).scalar_one_or_none()
+    return f"whatsapp:{result}" if result else None
+
+
+def get_students_by_moodle_ids(chatbot_db: Session, moodle_user_ids: List[int]) -> Dict[int, dict]:
+    """
+    Obtiene nombre y dirección de WhatsApp de varios usuarios de Moodle con una sola consulta IN.
+    Devuelve {moodle_user_id: {full_name, phone}}; los que no están en el directorio no aparecen.
+    """
+    ids = list({user_id for user_id in moodle_user_ids if user_id is not None})
+    if not ids:
+        return {}
+
+    query = text("""
+        SELECT moodle_user_id, full_name, phone_e164
+        FROM student_directory
+        WHERE moodle_user_id IN :ids
+    """).bindparams(bindparam("ids", expanding=True))
+    rows = chatbot_db.execute(query, {"ids": ids}).mappings().all()
+    return {row["moodle_user_id"]: {"full_name": row["full_name"], "phone": f"whatsapp:{row['phone_e164']}"} for row in rows}
+
+
+def upsert_students(chatbot_db: Session, users: list) -> int:
+    """
+    Inserta o actualiza usuarios de Moodle (filas de mdl_user) en el directorio.
+    Los borrados o sin teléfono utilizable se eliminan. No hace commit.
+    Devuelve la cantidad de alumnos guardados.
+    """
+    upserts = []
+    removals = []
+    synced_at = datetime.utcnow()
+    for user in users:
+        e164 = normalize_phone(user["phone1"])
+        if user["deleted"] or not e164:
+            removals.append(user["id"])
+            continue
+        upserts.append({
+            "moodle_user_id": user["id"],
+            "phone_e164": e164,
+            "phone_key": phone_key(e164),
+            "firstname": user["firstname"],
+            "lastname": user["lastname"],
+            "full_name": f"{user['firstname']} {user['lastname']}".strip(),
+            "moodle_timemodified": user["timemodified"] or 0,
+            "synced_at": synced_at,
+        })
+
+    if upserts:
+        chatbot_db.execute(text("""
+            INSERT INTO student_directory
+                (moodle_user_id, phone_e164, phone_key, firstname, lastname, full_name, moodle_timemodified, synced_at)
+            VALUES
+                (:moodle_user_id, :phone_e164, :phone_key, :firstname, :lastname, :full_name, :moodle_timemodified, :synced_at)
+            ON DUPLICATE KEY UPDATE
+                phone_e164 = VALUES(phone_e164),
+                phone_key = VALUES(phone_key),
+                firstname = VALUES(firstname),
+                lastname = VALUES(lastname),
+                full_name = VALUES(full_name),
+                moodle_timemodified = VALUES(moodle_timemodified),
+                synced_at = VALUES(synced_at)
+        """), upserts)
+
+    if removals:
+        chatbot_db.execute(
+            text("DELETE FROM student_directory WHERE moodle_user_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": removals}
+        )
+
+    return len(upserts)
+
+
+def sync_student_directory(moodle_db: Session, chatbot_db: Session, batch_size: int = 1000) -> int:
+    """
+    Sincroniza el directorio de forma incremental usando mdl_user.timemodified.
+    Cada lote se guarda junto con la marca de agua, así una corrida interrumpida
+    continúa desde el último lote confirmado.
+    Devuelve la cantidad de usuarios de Moodle procesados.
+    """
+    last_timemodified, last_id = get_sync_cursor(chatbot_db, SYNC_CURSOR_NAME) or (0, 0)
+    processed = 0
+
+    while True:
+        users = moodle_queries.get_users_modified_since(moodle_db, last_timemodified, last_id, limit=batch_size)
+        if not users:
+            break
+
+        upsert_students(chatbot_db, users)
+        last_timemodified, last_id = users[-1]["timemodified"], users[-1]["id"]
+        set_sync_cursor(chatbot_db, SYNC_CURSOR_NAME, last_timemodified, last_id)
+        chatbot_db.commit()
+
+        processed += len(users)
+        if len(users) < batch_size:
+            break
+
+    return processed
@@ -0,0 +1,86 @@
+# app/crud/kpi_queries.py
+
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import Dict, Any, Iterator, Optional
+from app.crud import course_queries, messages_queries, moodle_queries
+
+# Lock con nombre de MySQL que serializa los refrescos del snapshot (workers de la app y script)
+SNAPSHOT_LOCK_NAME = "kpi_snapshot_refresh"
+
+
+@contextmanager
+def snapshot_refresh_lock(lock_db: Session, wait_seconds: int = 0) -> Iterator[bool]:
+    """
+    Toma el lock del refresco del snapshot (GET_LOCK), esperando hasta 'wait_seconds'.
+    Dentro del with indica si se obtuvo; al salir lo libera. El lock es de la conexión:
+    lock_db se usa solo para esto y no hace commit mientras dura. En otros motores
+    (sin GET_LOCK) siempre se obtiene.
+    """
+    if lock_db.get_bind().dialect.name != "mysql":
+        yield True
+        return
+    acquired = lock_db.execute(
+        text("SELECT GET_LOCK(:name, :wait)"), {"name": SNAPSHOT_LOCK_NAME, "wait": wait_seconds}
+    ).scalar() == 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock_db.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": SNAPSHOT_LOCK_NAME})
+
+
+def get_snapshot_age_seconds(chatbot_db: Session) -> Optional[float]:
+    """Antigüedad del snapshot de KPIs en segundos, o None si todavía no se calculó."""
+    refreshed_at = chatbot_db.execute(text("SELECT refreshed_at FROM kpi_snapshot WHERE id = 1")).scalar()
+    return round((datetime.utcnow() - refreshed_at).total_seconds(), 1) if refreshed_at else None
+
+
+def refresh_kpi_snapshot(moodle_db: Session, chatbot_db: Session, full: bool = False) -> Dict[str, Any]:
+    """
+    Actualiza course_grade_stats y guarda en kpi_snapshot los totales de Moodle
+    (usuarios, aprobados y desaprobados). Hace commit. Devuelve el snapshot.
+    """
+    course_queries.refresh_course_grade_stats(moodle_db, chatbot_db, full=full)
+    approved, disapproved = chatbot_db.execute(text("""
+        SELECT COALESCE(SUM(approved), 0), COALESCE(SUM(disapproved), 0) FROM course_grade_stats
+    """)).one()
+    snapshot = {
+        "total_contacted": moodle_queries.count_users(moodle_db),
+        "approved": int(approved),
+        "disapproved": int(disapproved),
+        "refreshed_at": datetime.utcnow(),
+    }
+    chatbot_db.execute(text("""
+        INSERT INTO kpi_snapshot (id, total_contacted, approved, disapproved, refreshed_at)
+        VALUES (1, :total_contacted, :approved, :disapproved, :refreshed_at)
+        ON DUPLICATE KEY UPDATE
+            total_contacted = VALUES(total_contacted),
+            approved = VALUES(approved),
+            disapproved = VALUES(disapproved),
+            refreshed_at = VALUES(refreshed_at)
+    """), snapshot)
+    chatbot_db.commit()
+    return snapshot
+
+
+def get_kpi_data(chatbot_db: Session) -> Dict[str, Any]:
+    """
+    Devuelve los KPIs del dashboard: los de Moodle desde kpi_snapshot (lo actualiza
+    el refresco en segundo plano) y el total de mensajes desde el rollup diario.
+    'snapshot_age_seconds' es None si el snapshot todavía no se calculó.
+    """
+    snapshot = chatbot_db.execute(text("""
+        SELECT total_contacted, approved, disapproved, refreshed_at FROM kpi_snapshot WHERE id = 1
+    """)).mappings().first()
+    message_kpis = messages_queries.get_message_kpis(chatbot_db)
+
+    return {
+        "total_contacted": snapshot["total_contacted"] if snapshot else 0,
+        "approved": snapshot["approved"] if snapshot else 0,
+        "disapproved": snapshot["disapproved"] if snapshot else 0,
+        "total_interactions": message_kpis["total_messages"],
+        "snapshot_age_seconds": round((datetime.utcnow() - snapshot["refreshed_at"]).total_seconds(), 1) if snapshot else None,
+    }
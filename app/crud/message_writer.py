@@ -0,0 +1,180 @@
+# app/crud/message_writer.py
+
+import collections
+import threading
+import time
+from typing import Callable, Deque, List, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud.campaign_queries import LedgerKey, record_notifications
+from app.crud.crud_operations import message_values, update_conversation_state
+from app.db.session import SessionLocalChatbot
+from app.models.message import Message
+from app.schemas.message import MessageCreate
+
+
+Entry = Tuple[MessageCreate, Tuple[LedgerKey, str] | None]
+
+
+class BufferedMessageWriter:
+    """
+    Acumula mensajes salientes y los guarda con inserts de varias filas.
+    Se vacía al llegar a 'max_batch' mensajes, cada 'max_interval' segundos
+    (si se inició el hilo de fondo con start()) y al cerrarse.
+    Cada lote es una sola transacción: mensajes, estado de las conversaciones
+    y, si corresponde, el ledger de notificaciones. Si falla, el lote vuelve al
+    buffer (delante de lo nuevo) y se reintenta en el próximo vaciado; al fallar
+    'max_retries' veces se guarda fila por fila y las filas que siguen fallando
+    (p. ej. un valor demasiado largo) se descartan con log y quedan en dead_letters().
+    El buffer guarda a lo sumo 'max_buffer' mensajes: si la base no responde,
+    se descartan los más viejos.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocalChatbot,
+        max_batch: int = 100,
+        max_interval: float = 2.0,
+        max_retries: int = settings.MESSAGE_LOG_MAX_RETRIES,
+        max_buffer: int = settings.MESSAGE_LOG_MAX_BUFFER,
+    ):
+        self._session_factory = session_factory
+        self._max_batch = max_batch
+        self._max_interval = max_interval
+        self._max_retries = max_retries
+        self._max_buffer = max(max_buffer, max_batch)
+        self._buffer: List[Entry] = []
+        # Fallos seguidos del lote que está al frente del buffer
+        self._failures = 0
+        self._dead_letters: Deque[Entry] = collections.deque(maxlen=self._max_buffer)
+        self._lock = threading.Lock()
+        # Serializa los vaciados para que el orden de los mensajes se conserve
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._last_flush = time.monotonic()
+
+    def start(self) -> None:
+        """Inicia el hilo que vacía el buffer por tiempo."""
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, message: MessageCreate, ledger_entry: Tuple[LedgerKey, str] | None = None) -> None:
+        """Encola un mensaje (y opcionalmente su registro en el ledger)."""
+        with self._lock:
+            self._buffer.append((message, ledger_entry))
+            overflow = self._trim_buffer()
+            full = len(self._buffer) >= self._max_batch
+        self._drop(overflow, "el buffer está lleno")
+        if full:
+            self.flush()
+
+    def pending(self) -> List[Entry]:
+        """Lo que todavía no se pudo guardar (p. ej. después de un vaciado fallido)."""
+        with self._lock:
+            return list(self._buffer)
+
+    def dead_letters(self) -> List[Entry]:
+        """Lo que se descartó sin guardar (los últimos 'max_buffer')."""
+        with self._lock:
+            return list(self._dead_letters)
+
+    def flush(self) -> int:
+        """Guarda lo acumulado, en lotes de 'max_batch'. Devuelve la cantidad de mensajes escritos."""
+        written = 0
+        with self._flush_lock:
+            with self._lock:
+                self._last_flush = time.monotonic()
+            while True:
+                with self._lock:
+                    batch, self._buffer = self._buffer[:self._max_batch], self._buffer[self._max_batch:]
+                if not batch:
+                    return written
+
+                try:
+                    self._write(batch)
+                    written += len(batch)
+                    self._failures = 0
+                    continue
+                except Exception as e:
+                    self._failures += 1
+                    if self._failures < self._max_retries:
+                        # El lote no se pierde: vuelve al buffer, en orden, para el próximo vaciado
+                        with self._lock:
+                            self._buffer = batch + self._buffer
+                            overflow = self._trim_buffer()
+                        print(f"❌ Error al guardar {len(batch)} mensajes en la base de datos (intento {self._failures}, se reintentará): {e}")
+                        self._drop(overflow, "el buffer está lleno")
+                        return written
+
+                # Agotados los reintentos: fila por fila, para aislar la que falla
+                self._failures = 0
+                for entry in batch:
+                    try:
+                        self._write([entry])
+                        written += 1
+                    except Exception as e:
+                        self._drop([entry], str(e))
+
+    def _write(self, batch: List[Entry]) -> None:
+        db = self._session_factory()
+        try:
+            db.execute(insert(Message), [message_values(message) for message, _ in batch])
+
+            # Un solo upsert por conversación: gana el último nodo y se suman los turnos
+            states = {}
+            for message, _ in batch:
+                if message.direction == 'outgoing' and message.to_id:
+                    _, turns = states.get(message.to_id, (None, 0))
+                    states[message.to_id] = (message.template_id, turns + 1)
+            for phone, (template_id, turns) in states.items():
+                update_conversation_state(db, phone, template_id, turns=turns)
+
+            record_notifications(db, [entry for _, entry in batch if entry])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _trim_buffer(self) -> List[Entry]:
+        # Llamar con self._lock tomado: saca los más viejos que exceden max_buffer
+        overflow = len(self._buffer) - self._max_buffer
+        if overflow <= 0:
+            return []
+        dropped, self._buffer = self._buffer[:overflow], self._buffer[overflow:]
+        return dropped
+
+    def _drop(self, entries: List[Entry], reason: str) -> None:
+        if not entries:
+            return
+        with self._lock:
+            self._dead_letters.extend(entries)
+        for message, _ in entries:
+            print(f"🗑️ Mensaje descartado sin guardar (para {message.to_id}, nodo {message.template_id}): {reason}")
+
+    def close(self) -> None:
+        """Detiene el hilo de fondo y vacía lo pendiente."""
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._max_interval / 2):
+            if time.monotonic() - self._last_flush >= self._max_interval:
+                self.flush()
+
+    def __enter__(self) -> "BufferedMessageWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -2,87 +2,189 @@
 # app/crud/messages_queries.py
 
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
 from typing import Dict, Any
+import collections
+from datetime import date, datetime, time, timedelta
+from app.crud import directory_queries
+from app.crud.crud_operations import get_sync_cursor, set_sync_cursor
+from app.crud.pagination import encode_cursor, decode_cursor
 
 
-def get_message_kpis(db: Session) -> Dict[str, int]:
-    """Cuenta el total de mensajes, entrantes y salientes."""
-    query = text("""
-        SELECT
-            COUNT(id) AS total_messages,
-            COUNT(CASE WHEN direction = 'incoming' THEN 1 END) AS inbound_count,
-            COUNT(CASE WHEN direction = 'outgoing' THEN 1 END) AS outbound_count
-        FROM messages
-    """)
-    result = db.execute(query).mappings().first()
-    return dict(result) if result else {"total_messages": 0, "inbound_count": 0, "outbound_count": 0}
+STATS_CURSOR_NAME = "message_daily_stats"
+# Los mensajes más nuevos que esto aún pueden tener transacciones de IDs menores sin confirmar
+STATS_SETTLE_SECONDS = 60
 
 
-def get_timeline_data(db: Session) -> list:
-    """Agrupa los mensajes por día para el gráfico."""
-    query = text("""
-        SELECT
-            DATE(timestamp) AS date,
-            COUNT(id) AS count
+def refresh_message_daily_stats(db: Session, batch_size: int = 50000) -> int:
+    """
+    Suma a message_daily_stats los mensajes nuevos desde la marca de agua (messages.id).
+    Solo toma mensajes con más de STATS_SETTLE_SECONDS de antigüedad y avanza por lotes
+    de IDs; cada lote se confirma junto con la marca de agua. Devuelve la nueva marca de agua.
+    La fila de la marca de agua se bloquea (FOR UPDATE) durante cada lote: si corren
+    varios refrescos a la vez (un worker por proceso, el script), se turnan y
+    ninguno vuelve a sumar un rango ya sumado.
+    """
+    # La fila tiene que existir para poder bloquearla
+    db.execute(text("""
+        INSERT IGNORE INTO sync_cursors (name, last_timemodified, last_id, updated_at)
+        VALUES (:name, 0, 0, UTC_TIMESTAMP())
+    """), {"name": STATS_CURSOR_NAME})
+    db.commit()
+
+    # Sin lock alcanza: la marca de agua solo sirve de cota inferior del rango de la clave primaria
+    known_id = (get_sync_cursor(db, STATS_CURSOR_NAME) or (0, 0))[1]
+    settled_id = db.execute(text("""
+        SELECT MAX(id) FROM messages
+        WHERE id > :last_id AND timestamp < NOW() - INTERVAL :settle SECOND
+    """), {"last_id": known_id, "settle": STATS_SETTLE_SECONDS}).scalar() or 0
+    db.commit()
+
+    rollup_query = text("""
+        INSERT INTO message_daily_stats (day, direction, template_id, message_count)
+        SELECT DATE(timestamp), direction, COALESCE(template_id, ''), COUNT(*)
         FROM messages
-        GROUP BY DATE(timestamp)
-        ORDER BY date ASC
-        LIMIT 30
-    """)  # Limitamos a los últimos 30 días con datos
-    results = db.execute(query).mappings().all()
-    return [{"date": str(r['date']), "count": r['count']} for r in results]
+        WHERE id > :last_id AND id <= :upto_id
+        GROUP BY DATE(timestamp), direction, COALESCE(template_id, '')
+        ON DUPLICATE KEY UPDATE message_count = message_count + VALUES(message_count)
+    """)
+    lock_query = text("SELECT last_id FROM sync_cursors WHERE name = :name FOR UPDATE")
+    while True:
+        # Se relee bajo el lock: otro refresco pudo haber avanzado mientras esperábamos
+        last_id = db.execute(lock_query, {"name": STATS_CURSOR_NAME}).scalar()
+        if last_id >= settled_id:
+            db.commit()
+            return last_id
+        upto_id = min(last_id + batch_size, settled_id)
+        db.execute(rollup_query, {"last_id": last_id, "upto_id": upto_id})
+        set_sync_cursor(db, STATS_CURSOR_NAME, 0, upto_id)
+        db.commit()
 
 
-def get_filtered_messages(db: Session, filters: Dict[str, Any]) -> list:
+def _stats_with_tail(db: Session, rollup_sql: str, tail_sql: str) -> list:
     """
-    Obtiene mensajes y busca el nombre del remitente y del destinatario,
-    corrigiendo el filtro por nombre de alumno.
+    Filas del rollup más las de los mensajes posteriores a la marca de agua
+    (un rango chico sobre la clave primaria), para que los totales estén al día.
     """
-    base_query = """
-        SELECT
-            m.id,
-            m.direction,
-            m.message_body,
-            m.timestamp,
-            m.sender_id,
-            m.to_id,
-            s_sender.full_name AS sender_name,
-            s_receiver.full_name AS receiver_name
-        FROM messages m
-        LEFT JOIN students s_sender ON m.sender_id = s_sender.phone_number
-        LEFT JOIN students s_receiver ON m.to_id = s_receiver.phone_number
-        WHERE 1=1
+    last_id = (get_sync_cursor(db, STATS_CURSOR_NAME) or (0, 0))[1]
+    rows = list(db.execute(text(rollup_sql)).all())
+    rows += db.execute(text(tail_sql), {"last_id": last_id}).all()
+    return rows
+
+
+def get_message_kpis(db: Session) -> Dict[str, int]:
+    """Cuenta el total de mensajes, entrantes y salientes (desde message_daily_stats)."""
+    rows = _stats_with_tail(
+        db,
+        "SELECT direction, SUM(message_count) FROM message_daily_stats GROUP BY direction",
+        "SELECT direction, COUNT(*) FROM messages WHERE id > :last_id GROUP BY direction",
+    )
+    counts = collections.Counter()
+    for direction, count in rows:
+        counts[direction] += int(count)
+    return {
+        "total_messages": sum(counts.values()),
+        "inbound_count": counts["incoming"],
+        "outbound_count": counts["outgoing"],
+    }
+
+
+def get_timeline_data(db: Session, days: int = 30) -> list:
+    """Mensajes por día para el gráfico: los últimos 'days' días con datos, en orden cronológico."""
+    rows = _stats_with_tail(
+        db,
+        f"SELECT day, SUM(message_count) FROM message_daily_stats GROUP BY day ORDER BY day DESC LIMIT {int(days)}",
+        "SELECT DATE(timestamp) AS day, COUNT(*) FROM messages WHERE id > :last_id GROUP BY DATE(timestamp)",
+    )
+    counts = collections.Counter()
+    for day, count in rows:
+        counts[str(day)] += int(count)
+    return [{"date": day, "count": counts[day]} for day in sorted(counts)[-days:]]
+
+
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_MAX_PAGE_SIZE = 200
+
+
+def _parse_day(value: Any) -> date:
+    """Acepta 'YYYY-MM-DD' (o una fecha ISO con hora) y devuelve el día."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def get_filtered_messages(db: Session, filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Obtiene una página de mensajes (más recientes primero) con el nombre del remitente
+    y del destinatario. Filtros: student_name, direction, start_date, end_date,
+    limit y cursor (el 'next_cursor' de la página anterior).
+    Las fechas se aplican como rangos semiabiertos sobre timestamp y el nombre se
+    resuelve primero en el directorio de alumnos, así todo usa índices.
     """
-    params = {}
+    limit = min(int(filters.get("limit") or MESSAGE_PAGE_SIZE), MESSAGE_MAX_PAGE_SIZE)
+    where = []
+    params: Dict[str, Any] = {"limit": limit + 1}
 
-    # Applying filters dynamically...
     if filters.get("student_name"):
-        # --- CORRECCIÓN ---
-        # El filtro de nombre ahora se aplica a la conversación general
-        # Se buscan los IDs de los mensajes que pertenecen a conversaciones
-        # con un alumno que coincide con el nombre.
-        base_query += """ AND m.id IN (
-            SELECT m2.id FROM messages m2
-            LEFT JOIN students s2 ON m2.sender_id = s2.phone_number OR m2.to_id = s2.phone_number
-            WHERE s2.full_name LIKE :student_name
-        )"""
-        params["student_name"] = f"%{filters['student_name']}%"
+        # Búsqueda por prefijo en el directorio: un conjunto chico de teléfonos
+        phones = directory_queries.get_phones_by_name(db, filters["student_name"])
+        if not phones:
+            return {"messages": [], "next_cursor": None}
+        where.append("m.counterparty_phone IN :phones")
+        params["phones"] = phones
 
     if filters.get("direction"):
-        base_query += " AND m.direction = :direction"
+        where.append("m.direction = :direction")
         params["direction"] = filters["direction"]
 
     if filters.get("start_date"):
-        base_query += " AND DATE(m.timestamp) >= :start_date"
-        params["start_date"] = filters["start_date"]
+        where.append("m.timestamp >= :start_at")
+        params["start_at"] = datetime.combine(_parse_day(filters["start_date"]), time.min)
 
     if filters.get("end_date"):
-        base_query += " AND DATE(m.timestamp) <= :end_date"
-        params["end_date"] = filters["end_date"]
+        # Incluye todo el día final: hasta el comienzo del día siguiente (sin incluirlo)
+        where.append("m.timestamp < :end_before")
+        params["end_before"] = datetime.combine(_parse_day(filters["end_date"]) + timedelta(days=1), time.min)
+
+    cursor = decode_cursor(filters.get("cursor"), 2)
+    if cursor:
+        where.append("(m.timestamp < :cursor_ts OR (m.timestamp = :cursor_ts AND m.id < :cursor_id))")
+        params["cursor_ts"], params["cursor_id"] = cursor
+
+    query = text(f"""
+        SELECT
+            m.id,
+            m.direction,
+            m.message_body,
+            m.timestamp,
+            m.sender_id,
+            m.to_id,
+            m.counterparty_phone
+        FROM messages m
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY m.timestamp DESC, m.id DESC
+        LIMIT :limit
+    """)
+    if "phones" in params:
+        query = query.bindparams(bindparam("phones", expanding=True))
+    rows = db.execute(query, params).mappings().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
 
-    base_query += " ORDER BY m.timestamp DESC LIMIT 200"
+    # Nombres de los alumnos de la página, con una sola consulta al directorio
+    names = directory_queries.get_students_by_phone_numbers(db, list({row["counterparty_phone"] for row in rows if row["counterparty_phone"]}))
+    messages = []
+    for row in rows:
+        student_name = names.get(row["counterparty_phone"])
+        message = dict(row)
+        message.pop("counterparty_phone")
+        message["sender_name"] = student_name if row["direction"] == "incoming" else None
+        message["receiver_name"] = student_name if row["direction"] == "outgoing" else None
+        messages.append(message)
 
-    query = text(base_query)
-    results = db.execute(query, params).mappings().all()
-    return list(results)
+    return {"messages": messages, "next_cursor": next_cursor}
@@ -1,68 +1,17 @@
 # app/crud/moodle_queries.py
 
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
 from app.core.config import settings
 from datetime import datetime, time
-
-def get_students_by_phone_numbers(moodle_db: Session, phone_numbers: list[str]) -> dict[str, str]:
-    """
-    Obtiene los nombres completos de los estudiantes de Moodle dado una lista de números de teléfono,
-    intentando coincidir con diferentes formatos de número.
-    Retorna un diccionario mapeando número de teléfono a nombre completo.
-    """
-    if not phone_numbers:
-        return {}
-
-    conditions = []
-    params = {}
-    phone_map = {}
-
-    for i, phone in enumerate(phone_numbers):
-        # phone is like 'whatsapp:+54911...`
-        cleaned_phone = phone.replace('whatsapp:+', '') # '54911...'
-        phone_map[cleaned_phone] = phone
-
-        param_name = f"phone_{i}"
-        params[param_name] = cleaned_phone
-
-        conditions.append(f"phone1 = :{param_name}")
-        conditions.append(f"phone1 = CONCAT('+', :{param_name})")
-        conditions.append(f"RIGHT(phone1, 9) = RIGHT(:{param_name}, 9)")
-
-    full_condition = " OR ".join(conditions)
-
-    query = text(f"""
-        SELECT
-            phone1,
-            firstname,
-            lastname
-        FROM mdl_user
-        WHERE {full_condition}
-    """)
-
-    results = moodle_db.execute(query, params).mappings().all()
-
-    students_data = {}
-    for row in results:
-        full_name = f"{row['firstname']} {row['lastname']}".strip()
-        # Find the original phone number from the map
-        original_phone = phone_map.get(row['phone1'])
-        if original_phone:
-            students_data[original_phone] = full_name
-        else:
-            # Fallback for partial match
-            for cleaned, original in phone_map.items():
-                if cleaned.endswith(row['phone1'][-9:]):
-                    students_data[original] = full_name
-                    break
-
-    return students_data
+from typing import Iterator
 
 def get_student_by_phone(moodle_db: Session, phone_number: str) -> dict | None:
     """
     Obtiene el ID de Moodle y el nombre completo de un estudiante
     dado su número de teléfono.
+    Recorre todo mdl_user: usar directory_queries.get_student_by_phone
+    y dejar esta consulta solo como respaldo.
     """
     if not phone_number:
         return None
@@ -90,9 +39,27 @@ def get_student_by_phone(moodle_db: Session, phone_number: str) -> dict | None:
     return None
 
 
+def get_users_modified_since(moodle_db: Session, last_timemodified: int, last_id: int, limit: int = 1000) -> list:
+    """
+    Obtiene los usuarios de Moodle modificados después de la marca de agua
+    (timemodified, id), en orden, para sincronizar el directorio local.
+    """
+    query = text("""
+        SELECT id, firstname, lastname, phone1, deleted, timemodified
+        FROM mdl_user
+        WHERE timemodified > :last_timemodified
+           OR (timemodified = :last_timemodified AND id > :last_id)
+        ORDER BY timemodified, id
+        LIMIT :limit
+    """)
+    params = {"last_timemodified": last_timemodified, "last_id": last_id, "limit": limit}
+    return moodle_db.execute(query, params).mappings().all()
+
+
 def get_student_final_grade_by_phone(moodle_db: Session, phone_number: str) -> float | None:
     """
     Obtiene la calificación final de un estudiante dado su número de teléfono.
+    Para varios estudiantes usar get_final_grades con los IDs del directorio local.
     """
     student_data = get_student_by_phone(moodle_db, phone_number)
     if student_data:
@@ -104,22 +71,30 @@ def get_final_grade(moodle_db: Session, user_id: int) -> float | None:
     Ejecuta una consulta SQL directa a la base de datos de Moodle
     para obtener la calificación final de un usuario en un curso específico.
     """
-    course_id = settings.TARGET_COURSE_ID
+    return get_final_grades(moodle_db, [user_id]).get(user_id)
+
+def get_final_grades(moodle_db: Session, user_ids: list[int], course_id: int | None = None) -> dict[int, float]:
+    """
+    Obtiene las calificaciones finales de varios usuarios en un curso
+    (por defecto TARGET_COURSE_ID) con una sola consulta IN.
+    Devuelve {user_id: nota}; los usuarios sin nota no aparecen.
+    """
+    user_ids = list({user_id for user_id in user_ids if user_id is not None})
+    if not user_ids:
+        return {}
 
     query = text("""
-        SELECT gg.finalgrade
+        SELECT gg.userid, gg.finalgrade
         FROM mdl_grade_grades AS gg
         JOIN mdl_grade_items AS gi ON gg.itemid = gi.id
-        WHERE gg.userid = :user_id
-          AND gi.courseid = :course_id
-          AND gi.itemtype = 'course';
-    """)
-
-    result = moodle_db.execute(query, {"user_id": user_id, "course_id": course_id}).scalar_one_or_none()
+        WHERE gi.courseid = :course_id
+          AND gi.itemtype = 'course'
+          AND gg.userid IN :user_ids
+          AND gg.finalgrade IS NOT NULL
+    """).bindparams(bindparam("user_ids", expanding=True))
 
-    if result is not None:
-        return round(float(result), 2)
-    return None
+    params = {"user_ids": user_ids, "course_id": course_id or settings.TARGET_COURSE_ID}
+    return {row[0]: round(float(row[1]), 2) for row in moodle_db.execute(query, params).all()}
 
 def get_course_name_by_id(moodle_db: Session, course_id: int) -> str | None:
     """
@@ -129,9 +104,23 @@ def get_course_name_by_id(moodle_db: Session, course_id: int) -> str | None:
     result = moodle_db.execute(query, {"course_id": course_id}).scalar_one_or_none()
     return result
 
+# Nota mínima de aprobación (escala 0-10). Una nota 0 se toma como ausente.
+PASSING_GRADE = 6.0
+
+def exam_status(finalgrade: float | None) -> str:
+    """Color de un examen: green (aprobado), red (desaprobado), orange (ausente, nota 0) o gray (sin nota)."""
+    if finalgrade is None:
+        return "gray"
+    if finalgrade == 0:
+        return "orange"
+    if finalgrade >= PASSING_GRADE:
+        return "green"
+    return "red"
+
 def get_student_course_exam_history(moodle_db: Session, user_id: int) -> dict:
     """
     Obtiene el historial de exámenes (calificaciones) de un estudiante por curso.
+    Para muchos alumnos a la vez usar get_quiz_grade_columns.
     """
     query = text("""
         SELECT
@@ -143,7 +132,8 @@ def get_student_course_exam_history(moodle_db: Session, user_id: int) -> dict:
         JOIN mdl_grade_items AS gi ON gg.itemid = gi.id
         JOIN mdl_course AS c ON gi.courseid = c.id
         WHERE gg.userid = :user_id
-          AND gi.itemtype = 'mod_quiz' -- Assuming exams are quizzes
+          AND gi.itemtype = 'mod'
+          AND gi.itemmodule = 'quiz'
           AND gg.finalgrade IS NOT NULL
         ORDER BY c.fullname, gg.timemodified ASC;
     """)
@@ -152,62 +142,160 @@ def get_student_course_exam_history(moodle_db: Session, user_id: int) -> dict:
 
     course_exam_history = {}
     for row in results:
-        course_name = row['course_name']
-        if course_name not in course_exam_history:
-            course_exam_history[course_name] = []
-        
-        # Determine status based on finalgrade (assuming 6.0 is passing)
-        status = "gray" # Default
-        if row['finalgrade'] >= 6.0:
-            status = "green"
-        elif row['finalgrade'] < 6.0 and row['finalgrade'] is not None:
-            status = "red"
-        elif row['finalgrade'] == 0: # Assuming 0 means absent or not taken
-            status = "orange"
-
-        course_exam_history[course_name].append({
+        course_exam_history.setdefault(row['course_name'], []).append({
             "exam_name": row['exam_name'],
-            "status": status,
+            "status": exam_status(row['finalgrade']),
             "timestamp": row['timemodified']
         })
-    
+
     return course_exam_history
 
-def get_kpi_data(moodle_db: Session, chatbot_db: Session) -> dict:
+def get_quiz_grade_columns(moodle_db: Session, course_ids: list[int]) -> dict[str, list]:
+    """
+    Extrae en una sola consulta todas las notas de cuestionarios de los cursos dados,
+    en columnas: {"user_id": [...], "course_id": [...], "item_id": [...],
+    "finalgrade": [...], "timemodified": [...]}. finalgrade puede ser None (sin nota).
+    Pensado para el scoring de riesgo vectorizado (app/services/risk_scoring.py).
+    """
+    columns = {"user_id": [], "course_id": [], "item_id": [], "finalgrade": [], "timemodified": []}
+    if not course_ids:
+        return columns
+
+    query = text("""
+        SELECT gg.userid, gi.courseid, gi.id, gg.finalgrade, gg.timemodified
+        FROM mdl_grade_items AS gi
+        JOIN mdl_grade_grades AS gg ON gg.itemid = gi.id
+        WHERE gi.courseid IN :course_ids
+          AND gi.itemtype = 'mod'
+          AND gi.itemmodule = 'quiz'
+    """).bindparams(bindparam("course_ids", expanding=True))
+
+    rows = moodle_db.execute(query, {"course_ids": list(set(course_ids))}).all()
+    if rows:
+        for name, values in zip(columns, zip(*rows)):
+            columns[name] = list(values)
+    return columns
+
+def iter_course_grades_after(moodle_db: Session, last_timemodified: int, last_id: int, chunk_size: int = 500) -> Iterator[list]:
+    """
+    Recorre las calificaciones finales de cursos modificadas después de la marca de agua
+    (gg.timemodified, gg.id), en ese orden, con el alumno y el curso,
+    para las campañas de notificación.
+    Usa un cursor del lado del servidor y entrega lotes de 'chunk_size' filas, así la
+    memoria no depende del tamaño de la ventana y el envío empieza con el primer lote.
+    La sesión queda ocupada hasta terminar de recorrer: usar una sesión dedicada del pool
+    batch (SessionLocalMoodleBatch, con pymysql), que es el que soporta cursores del lado del servidor.
+    """
+    query = text("""
+        SELECT
+            gg.id AS grade_id,
+            gg.timemodified,
+            gi.id AS grade_item_id,
+            c.id AS course_id,
+            u.id AS user_id,
+            u.firstname,
+            c.fullname AS course_name,
+            gg.finalgrade
+        FROM
+            mdl_grade_grades AS gg
+        JOIN
+            mdl_grade_items AS gi ON gg.itemid = gi.id
+        JOIN
+            mdl_user AS u ON gg.userid = u.id
+        JOIN
+            mdl_course AS c ON gi.courseid = c.id
+        WHERE
+            gi.itemtype = 'course'
+            AND gg.finalgrade IS NOT NULL
+            AND (gg.timemodified > :last_timemodified
+                 OR (gg.timemodified = :last_timemodified AND gg.id > :last_id))
+        ORDER BY gg.timemodified, gg.id
+    """)
+    params = {"last_timemodified": last_timemodified, "last_id": last_id}
+
+    # Entre lote y lote el consumidor puede tardar (envíos con tope por segundo);
+    # evitamos que MySQL corte el cursor abierto por net_write_timeout.
+    moodle_db.execute(text("SET SESSION net_write_timeout = 3600"))
+    result = moodle_db.execute(query, params, execution_options={"stream_results": True, "yield_per": chunk_size})
+    try:
+        for partition in result.mappings().partitions(chunk_size):
+            yield partition
+    finally:
+        result.close()
+
+def get_courses_with_grade_changes(moodle_db: Session, since: int) -> tuple[list[int], int]:
+    """
+    Obtiene los cursos con alguna nota final de curso modificada desde 'since'
+    (gg.timemodified, inclusive) y el timemodified más alto encontrado.
+    Devuelve ([course_id, ...], max_timemodified); si no hubo cambios, ([], since).
+    """
+    query = text("""
+        SELECT gi.courseid, MAX(gg.timemodified) AS last_modified
+        FROM mdl_grade_grades AS gg
+        JOIN mdl_grade_items AS gi ON gg.itemid = gi.id
+        WHERE gi.itemtype = 'course'
+          AND gg.timemodified >= :since
+        GROUP BY gi.courseid
+    """)
+    rows = moodle_db.execute(query, {"since": since}).all()
+    return [row[0] for row in rows], max((row[1] for row in rows), default=since)
+
+def get_course_grade_stats(moodle_db: Session, course_ids: list[int]) -> dict[int, dict]:
     """
-    Calcula los KPIs. Aprobados/Desaprobados cuenta el total histórico.
+    Calcula, con una sola consulta IN, las estadísticas de notas finales de cada curso
+    (calificados, aprobados con nota >= 6, desaprobados y suma de notas) junto con
+    el nombre, la categoría y la fecha de inicio del curso.
+    Devuelve {course_id: {...}}; los cursos que ya no existen no aparecen.
     """
-    course_id = settings.TARGET_COURSE_ID
+    if not course_ids:
+        return {}
 
-    # Consulta a la DB de Moodle - SIN FILTRO DE FECHA
-    moodle_query = text("""
+    query = text("""
         SELECT
-            (SELECT COUNT(DISTINCT u.id) FROM mdl_user u) AS total_contacted,
+            c.id AS course_id,
+            c.fullname AS course_name,
+            c.category AS category_id,
+            c.startdate AS course_startdate,
+            COUNT(gg.id) AS graded_count,
             COUNT(CASE WHEN gg.finalgrade >= 6.0 THEN 1 END) AS approved,
-            COUNT(CASE WHEN gg.finalgrade < 6.0 THEN 1 END) AS disapproved
-        FROM mdl_grade_grades gg
-        JOIN mdl_grade_items gi ON gg.itemid = gi.id
-        WHERE gi.itemtype = 'course' 
-          AND gg.finalgrade IS NOT NULL
-    """)  # <-- Hemos quitado la línea 'AND gg.timemodified...'
-
-    moodle_result = moodle_db.execute(
-        moodle_query,
-        {"course_id": course_id}
-    ).mappings().first()
-
-    # Consulta a la DB del Chatbot (esta no cambia)
-    interactions_query = text("SELECT COUNT(id) AS total_interactions FROM messages")
-    chatbot_result = chatbot_db.execute(interactions_query).mappings().first()
-
-    # Combinamos los resultados
-    data = {
-        "total_contacted": moodle_result["total_contacted"] if moodle_result else 0,
-        "approved": moodle_result["approved"] if moodle_result else 0,
-        "disapproved": moodle_result["disapproved"] if moodle_result else 0,
-        "total_interactions": chatbot_result["total_interactions"] if chatbot_result else 0,
-    }
-    return data
+            COUNT(CASE WHEN gg.finalgrade < 6.0 THEN 1 END) AS disapproved,
+            COALESCE(SUM(gg.finalgrade), 0) AS grade_sum
+        FROM mdl_course AS c
+        LEFT JOIN mdl_grade_items AS gi ON gi.courseid = c.id AND gi.itemtype = 'course'
+        LEFT JOIN mdl_grade_grades AS gg ON gg.itemid = gi.id AND gg.finalgrade IS NOT NULL
+        WHERE c.id IN :course_ids
+        GROUP BY c.id, c.fullname, c.category, c.startdate
+    """).bindparams(bindparam("course_ids", expanding=True))
+
+    rows = moodle_db.execute(query, {"course_ids": list(set(course_ids))}).mappings().all()
+    return {row["course_id"]: dict(row) for row in rows}
+
+def count_users(moodle_db: Session) -> int:
+    """Cantidad de usuarios de Moodle (el KPI 'total_contacted')."""
+    return moodle_db.execute(text("SELECT COUNT(*) FROM mdl_user")).scalar() or 0
+
+def get_recovery_dates_for_courses(moodle_db: Session, course_ids: list[int], exam_name: str = "Recuperatorio") -> dict[int, datetime]:
+    """
+    Obtiene, en una sola consulta, la fecha del próximo examen recuperatorio
+    (cuestionario cuyo nombre contiene 'exam_name') de cada curso.
+    Retorna un diccionario mapeando ID de curso a fecha de apertura del examen.
+    Los cursos sin recuperatorio programado no aparecen.
+    """
+    if not course_ids:
+        return {}
+
+    query = text("""
+        SELECT q.course AS course_id, MIN(q.timeopen) AS timeopen
+        FROM mdl_quiz AS q
+        WHERE q.course IN :course_ids
+          AND q.name LIKE :exam_name
+          AND q.timeopen >= UNIX_TIMESTAMP()
+        GROUP BY q.course
+    """).bindparams(bindparam("course_ids", expanding=True))
+
+    params = {"course_ids": list(set(course_ids)), "exam_name": f"%{exam_name}%"}
+    results = moodle_db.execute(query, params).mappings().all()
+    return {row["course_id"]: datetime.fromtimestamp(row["timeopen"]) for row in results}
 
 def get_course_id_by_name(moodle_db: Session, course_name: str) -> int | None:
     """
@@ -0,0 +1,132 @@
+# app/crud/outbox_queries.py
+
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from sqlalchemy import text, bindparam
+from typing import Dict, Any, List, Tuple
+from app.models.message import OutboundMessage
+
+
+def enqueue_outbound(
+    db: Session,
+    to_id: str,
+    body: str | None = None,
+    message_id: int | None = None,
+    content_sid: str | None = None,
+    content_variables: str | None = None,
+) -> OutboundMessage:
+    """Agrega un mensaje pendiente al outbox. No hace commit (va en la transacción del llamador)."""
+    outbound = OutboundMessage(
+        message_id=message_id,
+        to_id=to_id,
+        body=body,
+        content_sid=content_sid,
+        content_variables=content_variables,
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(outbound)
+    return outbound
+
+
+def claim_batch(db: Session, batch_size: int, lease_seconds: float, max_attempts: int) -> List[Dict[str, Any]]:
+    """
+    Reclama hasta 'batch_size' mensajes vencidos (pendientes, o en envío con el reclamo vencido)
+    que todavía tengan intentos (attempts < max_attempts).
+    Usa FOR UPDATE SKIP LOCKED, así varios workers pueden reclamar en paralelo sin pisarse.
+    Los reclamados pasan a 'sending' con un vencimiento de 'lease_seconds': si el worker
+    se cae antes de marcarlos, otro los vuelve a tomar. Los que vencen sin intentos
+    restantes quedan 'failed'. Hace commit.
+    """
+    now = datetime.utcnow()
+    db.execute(text("""
+        UPDATE outbound_messages
+        SET status = 'failed', last_error = 'El reclamo del worker venció en el último intento'
+        WHERE status = 'sending'
+          AND next_attempt_at <= :now
+          AND attempts >= :max_attempts
+    """), {"now": now, "max_attempts": max_attempts})
+
+    rows = db.execute(text("""
+        SELECT id, to_id, body, content_sid, content_variables, attempts
+        FROM outbound_messages
+        WHERE status IN ('pending', 'sending')
+          AND next_attempt_at <= :now
+          AND attempts < :max_attempts
+        ORDER BY next_attempt_at, id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    """), {"now": now, "batch_size": batch_size, "max_attempts": max_attempts}).mappings().all()
+
+    if rows:
+        db.execute(text("""
+            UPDATE outbound_messages
+            SET status = 'sending', attempts = attempts + 1, next_attempt_at = :lease_until
+            WHERE id IN :ids
+        """).bindparams(bindparam("ids", expanding=True)), {
+            "ids": [row["id"] for row in rows],
+            "lease_until": now + timedelta(seconds=lease_seconds),
+        })
+    db.commit()
+    # attempts ya incluye el intento en curso
+    return [{**row, "attempts": row["attempts"] + 1} for row in rows]
+
+
+def release(db: Session, outbound_ids: List[int]) -> None:
+    """
+    Devuelve a 'pending' mensajes reclamados que no se llegaron a enviar (sin gastar
+    el intento), para que se reclamen de nuevo enseguida. No hace commit.
+    """
+    if not outbound_ids:
+        return
+    db.execute(text("""
+        UPDATE outbound_messages
+        SET status = 'pending', attempts = attempts - 1, next_attempt_at = :now
+        WHERE id IN :ids AND status = 'sending'
+    """).bindparams(bindparam("ids", expanding=True)), {"ids": outbound_ids, "now": datetime.utcnow()})
+
+
+def mark_sent(db: Session, results: List[Tuple[int, str]]) -> None:
+    """Marca como enviados los mensajes [(id, twilio_sid), ...]. No hace commit."""
+    if not results:
+        return
+    sent_at = datetime.utcnow()
+    db.execute(text("""
+        UPDATE outbound_messages
+        SET status = 'sent', twilio_sid = :twilio_sid, sent_at = :sent_at, last_error = NULL
+        WHERE id = :id
+    """), [{"id": outbound_id, "twilio_sid": sid, "sent_at": sent_at} for outbound_id, sid in results])
+
+
+def mark_failed(db: Session, outbound_id: int, attempts: int, error: str, max_attempts: int, backoff_seconds: float) -> str:
+    """
+    Registra un envío fallido. Se reintenta con backoff exponencial
+    (backoff_seconds * 2^(intentos-1), hasta una hora) o queda 'failed'
+    después de 'max_attempts' intentos. No hace commit. Devuelve el nuevo estado.
+    """
+    status = "failed" if attempts >= max_attempts else "pending"
+    delay = min(backoff_seconds * 2 ** (attempts - 1), 3600)
+    db.execute(text("""
+        UPDATE outbound_messages
+        SET status = :status, last_error = :error, next_attempt_at = :next_attempt_at
+        WHERE id = :id
+    """), {
+        "id": outbound_id,
+        "status": status,
+        "error": error[:1000],
+        "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+    })
+    return status
+
+
+def get_outbox_stats(db: Session) -> Dict[str, Any]:
+    """Cantidad de mensajes por estado y antigüedad (segundos) del pendiente más viejo."""
+    counts = db.execute(text("SELECT status, COUNT(*) FROM outbound_messages GROUP BY status")).all()
+    oldest = db.execute(text("""
+        SELECT MIN(created_at) FROM outbound_messages WHERE status IN ('pending', 'sending')
+    """)).scalar()
+    return {
+        "by_status": {status: count for status, count in counts},
+        "oldest_pending_seconds": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+    }
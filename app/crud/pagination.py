@@ -0,0 +1,31 @@
+# app/crud/pagination.py
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Arma un cursor opaco para paginación por clave (keyset) con los valores
+    de la última fila de la página. Las fechas se guardan en ISO 8601.
+    """
+    payload = [{"dt": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str | None, size: int) -> List[Any] | None:
+    """
+    Devuelve los valores de un cursor de encode_cursor, o None si no hay cursor.
+    Lanza ValueError si el cursor no es válido.
+    """
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, list) or len(payload) != size:
+            raise ValueError("wrong size")
+        return [datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value for value in payload]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid pagination cursor") from e
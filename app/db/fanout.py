@@ -0,0 +1,96 @@
+# app/db/fanout.py
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+# MySQL: "Query execution was interrupted, maximum statement execution time exceeded"
+MAX_EXECUTION_TIME_EXCEEDED = 3024
+
+_executor = ThreadPoolExecutor(max_workers=settings.DB_FANOUT_WORKERS, thread_name_prefix="db-fanout")
+
+
+class QueryDeadlineExceeded(Exception):
+    """Una consulta del fan-out no terminó dentro de su deadline."""
+
+    def __init__(self, name: str, timeout: float):
+        super().__init__(f"La consulta '{name}' superó su deadline de {timeout:g}s")
+        self.name = name
+        self.timeout = timeout
+
+
+@contextmanager
+def statement_deadline(session: Session, timeout: float | None) -> Iterator[None]:
+    """
+    Limita cada SELECT de la sesión a 'timeout' segundos con max_execution_time de MySQL:
+    el servidor corta la consulta que se pasa, en vez de dejarla corriendo.
+    Al salir restaura el valor anterior de la conexión. En otros motores no hace nada.
+    """
+    if not timeout or session.get_bind().dialect.name != "mysql":
+        yield
+        return
+    session.execute(
+        text("SET @fanout_previous_met = @@SESSION.max_execution_time, SESSION max_execution_time = :ms"),
+        {"ms": int(timeout * 1000)},
+    )
+    try:
+        yield
+    finally:
+        session.execute(text("SET SESSION max_execution_time = @fanout_previous_met"))
+
+
+def _run(name: str, timeout: float | None, session: Session, func: Callable[..., Any], args: tuple) -> Any:
+    try:
+        with statement_deadline(session, timeout):
+            return func(session, *args)
+    except DBAPIError as e:
+        # pymysql/mysqlclient traen el código en args[0]; mysql-connector en errno
+        code = getattr(e.orig, "errno", None) or (e.orig.args[0] if e.orig is not None and e.orig.args else None)
+        if code == MAX_EXECUTION_TIME_EXCEEDED:
+            raise QueryDeadlineExceeded(name, timeout) from e
+        raise
+
+
+def fan_out(calls: Dict[str, Tuple], timeout: float | None = None) -> Dict[str, Any]:
+    """
+    Corre en paralelo consultas independientes, cada una con su sesión:
+    calls = {"nombre": (session, func, *args)} ejecuta func(session, *args).
+    La primera corre en el hilo actual y el resto en el pool, así un endpoint que
+    consulta la DB del chatbot y la de Moodle tarda el máximo de las dos, no la suma.
+    Cada consulta tiene un deadline de 'timeout' segundos (por defecto
+    DB_QUERY_TIMEOUT_SECONDS) que MySQL hace cumplir cortándola (max_execution_time,
+    con el timeout de lectura del pool como respaldo); si alguna se pasa lanza
+    QueryDeadlineExceeded. Devuelve {"nombre": resultado}.
+    Nunca vuelve (ni lanza) mientras un hilo del pool siga usando una de las sesiones,
+    así el llamador puede cerrarlas sin pisarse con ese hilo.
+    Cada sesión debe aparecer en una sola llamada: una Session no se usa desde dos hilos.
+    """
+    timeout = settings.DB_QUERY_TIMEOUT_SECONDS if timeout is None else timeout
+    items = list(calls.items())
+    futures = {
+        name: _executor.submit(_run, name, timeout, session, func, args)
+        for name, (session, func, *args) in items[1:]
+    }
+
+    results = {}
+    try:
+        if items:
+            name, (session, func, *args) = items[0]
+            results[name] = _run(name, timeout, session, func, tuple(args))
+    except BaseException:
+        # Las que todavía no arrancaron no hace falta correrlas; las demás se esperan
+        for future in futures.values():
+            future.cancel()
+        wait(futures.values())
+        raise
+
+    wait(futures.values())
+    for name, future in futures.items():
+        results[name] = future.result()
+    return results
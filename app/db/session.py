@@ -1,31 +1,153 @@
 # app/db/session.py
 
-from sqlalchemy import create_engine
+import collections
+import threading
+import time
+from typing import Dict, Any
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from app.core.config import settings
 
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._recent_waits = collections.deque(maxlen=1000)
+
+    def recreate(self):
+        # Al recrear el pool (p. ej. con dispose()) se conservan las métricas
+        new_pool = super().recreate()
+        new_pool._checkouts, new_pool._timeouts = self._checkouts, self._timeouts
+        new_pool._total_wait, new_pool._max_wait = self._total_wait, self._max_wait
+        new_pool._recent_waits.extend(self._recent_waits)
+        return new_pool
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        wait = time.perf_counter() - started_at
+        with self._stats_lock:
+            self._checkouts += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._recent_waits.append(wait)
+        return connection
+
+    def stats(self) -> Dict[str, Any]:
+        """Conexiones en uso y tiempos de espera del checkout (en ms; p95 sobre los últimos 1000)."""
+        with self._stats_lock:
+            recent = sorted(self._recent_waits)
+            checkouts, timeouts = self._checkouts, self._timeouts
+            total_wait, max_wait = self._total_wait, self._max_wait
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "avg_wait_ms": round(total_wait / checkouts * 1000, 2) if checkouts else 0.0,
+            "p95_wait_ms": round(recent[min(int(len(recent) * 0.95), len(recent) - 1)] * 1000, 2) if recent else 0.0,
+            "max_wait_ms": round(max_wait * 1000, 2),
+        }
+
+
 # --- Conexión a la Base de Datos del Chatbot ---
 CHATBOT_DB_URL = f"mysql+pymysql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
 
 # Añadimos pool_recycle y pool_pre_ping para mantener la conexión viva
 engine_chatbot = create_engine(
     CHATBOT_DB_URL,
+    poolclass=InstrumentedQueuePool,
     pool_recycle=3600,  # Recicla la conexión cada hora
     pool_pre_ping=True  # Verifica la conexión antes de cada uso
 )
 SessionLocalChatbot = sessionmaker(autocommit=False, autoflush=False, bind=engine_chatbot)
 
 
-# --- Conexión a la Base de Datos de Moodle (Solo Lectura) ---
-MOODLE_DB_URL = f"mysql+mysqlconnector://{settings.MOODLE_DB_USER}:{settings.MOODLE_DB_PASSWORD}@{settings.MOODLE_DB_HOST}:{settings.MOODLE_DB_PORT}/{settings.MOODLE_DB_NAME}"
+# --- Conexiones a la Base de Datos de Moodle (Solo Lectura) ---
+# Un pool por tipo de carga, para que los agregados pesados no dejen sin conexiones al webhook:
+#   interactive: webhook, CRM y envíos puntuales (consultas cortas, deadline corto)
+#   analytics:   scoring de riesgo, snapshot de KPIs y estadísticas de cursos (puede ir a una réplica)
+#   batch:       campañas, sincronización del directorio y scripts (cursores largos, sin deadline)
+MOODLE_WORKLOADS = ("interactive", "analytics", "batch")
+# El pool batch usa siempre pymysql: es el que soporta cursores del lado del servidor,
+# así las extracciones de las campañas (stream_results) no cargan todo en memoria
+MOODLE_BATCH_DRIVER = "pymysql"
 
-# Hacemos lo mismo para la conexión de Moodle
-engine_moodle = create_engine(
-    MOODLE_DB_URL,
-    pool_recycle=3600,
-    pool_pre_ping=True
-)
+
+def _moodle_url(host: str, driver: str = settings.MOODLE_DB_DRIVER) -> str:
+    return f"mysql+{driver}://{settings.MOODLE_DB_USER}:{settings.MOODLE_DB_PASSWORD}@{host}:{settings.MOODLE_DB_PORT}/{settings.MOODLE_DB_NAME}"
+
+MOODLE_DB_URL = _moodle_url(settings.MOODLE_DB_HOST)
+
+
+def _read_timeout_args(driver: str, read_timeout: int) -> Dict[str, Any]:
+    """Timeout de lectura del socket según el driver (0 = sin timeout)."""
+    if not read_timeout:
+        return {}
+    if driver == "mysqlconnector":
+        return {"connection_timeout": read_timeout}
+    return {"read_timeout": read_timeout}
+
+
+def _create_moodle_engine(workload: str):
+    prefix = f"MOODLE_POOL_{workload.upper()}"
+    host = settings.MOODLE_DB_HOST
+    if workload == "analytics" and settings.MOODLE_REPLICA_HOST:
+        host = settings.MOODLE_REPLICA_HOST
+    driver = MOODLE_BATCH_DRIVER if workload == "batch" else settings.MOODLE_DB_DRIVER
+
+    engine = create_engine(
+        _moodle_url(host, driver),
+        poolclass=InstrumentedQueuePool,
+        pool_size=getattr(settings, f"{prefix}_SIZE"),
+        max_overflow=getattr(settings, f"{prefix}_OVERFLOW"),
+        pool_timeout=getattr(settings, f"{prefix}_CHECKOUT_TIMEOUT_SECONDS"),
+        pool_recycle=3600,
+        pool_pre_ping=True,
+        connect_args=_read_timeout_args(driver, getattr(settings, f"{prefix}_READ_TIMEOUT_SECONDS")),
+    )
+
+    statement_timeout_ms = getattr(settings, f"{prefix}_STATEMENT_TIMEOUT_MS")
+    if statement_timeout_ms:
+        @event.listens_for(engine, "connect")
+        def set_statement_timeout(dbapi_connection, connection_record):
+            # MySQL corta los SELECT de esta conexión que tarden más que esto
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET SESSION max_execution_time = {int(statement_timeout_ms)}")
+            cursor.close()
+
+    return engine
+
+
+moodle_engines = {workload: _create_moodle_engine(workload) for workload in MOODLE_WORKLOADS}
+
+engine_moodle = moodle_engines["interactive"]
 SessionLocalMoodle = sessionmaker(autocommit=False, autoflush=False, bind=engine_moodle)
+SessionLocalMoodleAnalytics = sessionmaker(autocommit=False, autoflush=False, bind=moodle_engines["analytics"])
+SessionLocalMoodleBatch = sessionmaker(autocommit=False, autoflush=False, bind=moodle_engines["batch"])
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Métricas de los pools de conexiones: el del chatbot y uno por carga de Moodle."""
+    pools = {"chatbot": engine_chatbot.pool}
+    pools.update({f"moodle_{workload}": engine.pool for workload, engine in moodle_engines.items()})
+    return {name: pool.stats() for name, pool in pools.items()}
 
 
 # --- Dependencias de FastAPI para inyectar las sesiones ---
@@ -41,4 +163,11 @@ def get_moodle_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_moodle_analytics_db():
+    db = SessionLocalMoodleAnalytics()
+    try:
+        yield db
+    finally:
+        db.close()
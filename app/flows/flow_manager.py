@@ -1,11 +1,19 @@
 import json
 import os
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Tuple
 
 # Get the directory of the current script to build a reliable path
 script_dir = os.path.dirname(__file__)
 FLOWS_FILE = os.path.join(script_dir, "flows.json")
 
+# In-memory compiled graph used by the webhook. It is rebuilt only when the
+# flow store changes: save_flows() bumps _flows_version and the file mtime
+# catches edits made outside this process.
+_compiled_lock = threading.Lock()
+_flows_version = 0
+_compiled: Dict[str, Any] = {"key": None, "nodes": {}, "transitions": {}, "template_sids": {}}
+
 def load_flows() -> List[Dict[str, Any]]:
     """Loads conversation flows from the JSON file."""
     try:
@@ -16,8 +24,76 @@ def load_flows() -> List[Dict[str, Any]]:
 
 def save_flows(flows: List[Dict[str, Any]]) -> None:
     """Saves conversation flows to the JSON file."""
+    global _flows_version
     with open(FLOWS_FILE, "w") as f:
         json.dump(flows, f, indent=2)
+    with _compiled_lock:
+        _flows_version += 1
+
+def normalize_reply(text: str | None) -> str:
+    """Normalizes a user reply (or an edge label) for transition matching."""
+    return (text or "").strip().lower()
+
+def _store_mtime() -> int | None:
+    try:
+        return os.stat(FLOWS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _compile(flows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Builds the node-id -> (flow, node) index and the per-node reply -> next node map."""
+    nodes = {}
+    transitions = {}
+    template_sids = {}
+    for flow in flows:
+        flow_nodes = {node["id"]: node for node in flow.get("nodes", [])}
+        for node_id, node in flow_nodes.items():
+            # First flow wins, as in the previous linear scan
+            nodes.setdefault(node_id, (flow, node))
+            template_sid = node.get("data", {}).get("template_sid")
+            if template_sid:
+                template_sids.setdefault(template_sid, node_id)
+        for edge in flow.get("edges", []):
+            source = edge.get("source")
+            target = flow_nodes.get(edge.get("target"))
+            # Only edges of the flow that owns the source node are reachable
+            if target is None or source not in nodes or nodes[source][0] is not flow:
+                continue
+            transitions.setdefault(source, {}).setdefault(normalize_reply(edge.get("labelText")), target)
+    return {"nodes": nodes, "transitions": transitions, "template_sids": template_sids}
+
+def _get_compiled() -> Dict[str, Any]:
+    """Returns the compiled graph, rebuilding it if the flow store changed."""
+    global _compiled
+    compiled = _compiled
+    if compiled["key"] == (_flows_version, _store_mtime()):
+        return compiled
+    with _compiled_lock:
+        key = (_flows_version, _store_mtime())
+        if _compiled["key"] != key:
+            _compiled = {"key": key, **_compile(load_flows())}
+        return _compiled
+
+def get_node(node_id: str | None) -> Tuple[Dict[str, Any], Dict[str, Any]] | None:
+    """Returns the (flow, node) pair for a node ID, or None if it is unknown."""
+    if not node_id:
+        return None
+    return _get_compiled()["nodes"].get(node_id)
+
+def resolve_node(template_id: str | None) -> Tuple[Dict[str, Any], Dict[str, Any]] | None:
+    """
+    Returns the (flow, node) pair for a message template_id, which holds either
+    a node ID or, for older campaign messages, the node's Twilio template_sid.
+    """
+    if not template_id:
+        return None
+    compiled = _get_compiled()
+    node_id = template_id if template_id in compiled["nodes"] else compiled["template_sids"].get(template_id)
+    return compiled["nodes"].get(node_id) if node_id else None
+
+def get_next_node(node_id: str | None, reply: str | None) -> Dict[str, Any] | None:
+    """Returns the node reached from node_id when the user answers reply."""
+    return _get_compiled()["transitions"].get(node_id, {}).get(normalize_reply(reply))
 
 def get_flows() -> List[Dict[str, Any]]:
     """Returns all conversation flows."""
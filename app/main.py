@@ -1,6 +1,13 @@
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routers import whatsapp, notifications, auth, dashboard, courses, flows, crm, messages, users
+from app.api.routers import whatsapp, notifications, auth, dashboard, courses, flows, crm, messages, users, metrics
+from app.core.config import settings
+from app.services.inbound_queue import inbound_queue
+from app.services.outbox_sender import outbox_sender
+from app.services.message_stats import message_stats_refresher
+from app.services.kpi_snapshot import kpi_snapshot_refresher
+from app.services.twilio_transport import twilio_transport
 
 app = FastAPI(
     title="Moodle Chatbot Backend",
@@ -38,6 +45,32 @@ app.include_router(flows.router, prefix="/api", tags=["Flows"])
 app.include_router(crm.router, prefix="/api", tags=["CRM"])
 app.include_router(messages.router, prefix="/api", tags=["Messages"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
+app.include_router(metrics.router, prefix="/api", tags=["Metrics"])
+
+
+@app.on_event("startup")
+def start_background_workers():
+    # Workers de la cola de entrada del webhook (modo fast-ack)
+    if settings.WEBHOOK_FAST_ACK:
+        inbound_queue.start()
+    # Worker del outbox dentro de la app (o aparte, con scripts/run_outbox_sender.py)
+    if settings.OUTBOX_ENABLED and settings.OUTBOX_SENDER_IN_APP:
+        outbox_sender.start()
+    # Rollup diario de mensajes para el timeline y los KPIs
+    message_stats_refresher.start()
+    # Snapshot de KPIs de Moodle para /api/kpis
+    kpi_snapshot_refresher.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await run_in_threadpool(inbound_queue.stop)
+    await run_in_threadpool(outbox_sender.stop)
+    await run_in_threadpool(message_stats_refresher.stop)
+    await run_in_threadpool(kpi_snapshot_refresher.stop)
+    # Cierra las conexiones abiertas con Twilio
+    twilio_transport.close()
+    await twilio_transport.aclose()
 
 
 @app.get("/")
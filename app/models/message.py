@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Enum, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Enum, DateTime, Date, ForeignKey, Boolean, Numeric, Float, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import declarative_base
 import datetime
@@ -19,6 +19,10 @@ class CrmUser(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_counterparty_timestamp", "counterparty_phone", "timestamp"),
+        Index("ix_messages_timestamp", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(String(50), nullable=False)
@@ -27,6 +31,12 @@ class Message(Base):
     to_id = Column(String(50), nullable=True)
     template_id = Column(String(255), nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Curso y nota que originaron el mensaje (solo para notificaciones de campañas)
+    course_id = Column(Integer, nullable=True)
+    course_name = Column(String(255), nullable=True)
+    grade_item_id = Column(Integer, nullable=True)
+    # Teléfono del alumno (E.164): el destinatario si es saliente, el remitente si es entrante
+    counterparty_phone = Column(String(20), nullable=True)
 
 class Student(Base):
     __tablename__ = "students"
@@ -63,4 +73,124 @@ class DashboardAlert(Base):
     alert_type = Column(String(50), nullable=False) # e.g., 'human_intervention_needed', 'recovery_reminder'
     description = Column(Text, nullable=True)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
-    is_resolved = Column(Boolean, default=False)
\ No newline at end of file
+    is_resolved = Column(Boolean, default=False)
+
+class StudentDirectory(Base):
+    """Espejo local de los alumnos de Moodle, indexado por teléfono normalizado."""
+    __tablename__ = "student_directory"
+
+    moodle_user_id = Column(Integer, primary_key=True, autoincrement=False)
+    phone_e164 = Column(String(20), index=True, nullable=False)
+    phone_key = Column(String(9), index=True, nullable=False) # Últimos 9 dígitos
+    # Indexados para la búsqueda por prefijo de nombre o apellido
+    firstname = Column(String(100), index=True, nullable=True)
+    lastname = Column(String(100), index=True, nullable=True)
+    full_name = Column(String(255), index=True, nullable=False)
+    moodle_timemodified = Column(BigInteger, nullable=False, default=0)
+    synced_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class SyncCursor(Base):
+    """Marca de agua de los procesos incrementales (p. ej. 'student_directory')."""
+    __tablename__ = "sync_cursors"
+
+    name = Column(String(50), primary_key=True)
+    last_timemodified = Column(BigInteger, nullable=False, default=0)
+    last_id = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class ConversationState(Base):
+    """Estado actual de la conversación con cada alumno (nodo del flujo en el que está)."""
+    __tablename__ = "conversation_states"
+
+    phone = Column(String(20), primary_key=True) # Teléfono normalizado (E.164)
+    flow_id = Column(Integer, nullable=True)
+    node_id = Column(String(255), nullable=True)
+    last_activity = Column(DateTime(timezone=True), server_default=func.now())
+    turn_count = Column(Integer, nullable=False, default=0) # Mensajes salientes en la conversación
+
+
+class NotificationLedger(Base):
+    """Registro de notas ya notificadas, para no repetir envíos entre campañas."""
+    __tablename__ = "notification_ledger"
+    __table_args__ = (
+        UniqueConstraint("moodle_user_id", "course_id", "grade_item_id", "grade_value", name="uq_notification_ledger_grade"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    moodle_user_id = Column(Integer, nullable=False)
+    course_id = Column(Integer, nullable=False)
+    grade_item_id = Column(Integer, nullable=False, index=True)
+    grade_value = Column(Numeric(10, 5), nullable=False)
+    status = Column(String(20), nullable=False) # passed, failed, absent
+    notified_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class OutboundMessage(Base):
+    """
+    Outbox de mensajes salientes: se confirma junto con el mensaje en 'messages'
+    y un worker (app/services/outbox_sender.py) lo envía a Twilio.
+    """
+    __tablename__ = "outbound_messages"
+    __table_args__ = (
+        Index("ix_outbound_messages_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    to_id = Column(String(50), nullable=False)
+    body = Column(Text, nullable=True)
+    content_sid = Column(String(64), nullable=True) # Plantilla de Twilio, si aplica
+    content_variables = Column(Text, nullable=True) # JSON de variables de la plantilla
+    status = Column(String(20), nullable=False, default="pending") # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    # Próximo intento; mientras está 'sending' es el vencimiento del reclamo del worker
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    twilio_sid = Column(String(64), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+
+class MessageDailyStat(Base):
+    """Cantidad de mensajes por día, dirección y plantilla/nodo (la mantiene refresh_message_daily_stats)."""
+    __tablename__ = "message_daily_stats"
+
+    day = Column(Date, primary_key=True)
+    direction = Column(String(10), primary_key=True)
+    template_id = Column(String(255), primary_key=True, default="") # '' si el mensaje no tiene plantilla
+    message_count = Column(Integer, nullable=False, default=0)
+
+
+class CourseGradeStat(Base):
+    """
+    Estadísticas de notas finales por curso de Moodle (rankings y snapshot de KPIs).
+    La mantiene course_queries.refresh_course_grade_stats desde mdl_grade_grades.timemodified.
+    """
+    __tablename__ = "course_grade_stats"
+    __table_args__ = (
+        Index("ix_course_grade_stats_rate", "approval_rate", "course_id"),
+        Index("ix_course_grade_stats_category_rate", "category_id", "approval_rate"),
+    )
+
+    course_id = Column(Integer, primary_key=True, autoincrement=False)
+    course_name = Column(String(255), nullable=True)
+    category_id = Column(Integer, nullable=True)
+    course_startdate = Column(BigInteger, nullable=False, default=0) # Unix timestamp, como en mdl_course
+    graded_count = Column(Integer, nullable=False, default=0)
+    approved = Column(Integer, nullable=False, default=0)
+    disapproved = Column(Integer, nullable=False, default=0)
+    grade_sum = Column(Numeric(15, 5), nullable=False, default=0) # Para la nota promedio
+    approval_rate = Column(Float, nullable=False, default=0) # Porcentaje de aprobados
+    refreshed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class KpiSnapshot(Base):
+    """Último cálculo de los KPIs de Moodle del dashboard (una sola fila, id = 1)."""
+    __tablename__ = "kpi_snapshot"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    total_contacted = Column(Integer, nullable=False, default=0)
+    approved = Column(Integer, nullable=False, default=0)
+    disapproved = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
@@ -1,9 +1,11 @@
 #app/schemas/kpi.py
 
 from pydantic import BaseModel
+from typing import Optional
 
 class KpiData(BaseModel):
     total_contacted: int
     approved: int
     disapproved: int
-    total_interactions: int
\ No newline at end of file
+    total_interactions: int
+    snapshot_age_seconds: Optional[float] = None # Antigüedad del snapshot de Moodle
\ No newline at end of file
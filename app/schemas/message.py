@@ -9,6 +9,9 @@ class MessageBase(BaseModel):
     message_body: str | None = None
     to_id: Optional[str] = None
     template_id: Optional[str] = None
+    course_id: Optional[int] = None
+    course_name: Optional[str] = None
+    grade_item_id: Optional[int] = None
 
 class MessageCreate(MessageBase):
     direction: Literal['incoming', 'outgoing']
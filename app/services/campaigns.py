@@ -0,0 +1,261 @@
+# app/services/campaigns.py
+
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable
+
+from app.core.config import settings
+from app.crud import moodle_queries
+from app.crud.campaign_queries import LedgerKey, ledger_key, get_notified_keys
+from app.crud.crud_operations import get_sync_cursor, set_sync_cursor
+from app.crud.message_writer import BufferedMessageWriter
+from app.db.session import SessionLocalChatbot, SessionLocalMoodleBatch
+from app.flows import flow_manager
+from app.schemas.message import MessageCreate
+from app.services.rate_limiter import TokenBucket
+from app.services.twilio_transport import twilio_transport
+
+# Estado del alumno -> flujo y nodo inicial con el que arranca la conversación
+STATUS_TO_FLOW = {
+    "passed": {"flow_name": "Alumno APROBADO", "node_id": "APROBADO_1"},
+    "failed": {"flow_name": "Alumno DESAPROBADO", "node_id": "DESAPROBADO_1"},
+    "absent": {"flow_name": "Alumno PENDIENTE", "node_id": "PENDIENTE_1"},
+}
+
+PASSING_GRADE = 6.0
+
+
+def classify_grade(final_grade: float) -> str:
+    """Clasifica una nota final: 0 es ausente, >= 6 aprobado, el resto desaprobado."""
+    if final_grade == 0:
+        return "absent"
+    if final_grade >= PASSING_GRADE:
+        return "passed"
+    return "failed"
+
+
+def cursor_name(statuses: Iterable[str]) -> str:
+    """Cada combinación de estados tiene su propia marca de agua (p. ej. 'grade_notifications:failed')."""
+    return "grade_notifications:" + ",".join(sorted(statuses))
+
+
+@dataclass
+class CampaignMessage:
+    key: LedgerKey
+    previous_cursor: tuple[int, int] # Marca de agua anterior a esta nota
+    status: str
+    student_name: str
+    course_id: int
+    course_name: str
+    grade_item_id: int
+    node_id: str
+    template_sid: str
+    content_variables: Dict[str, str]
+    body_for_db: str
+
+
+def resolve_start_nodes(statuses: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Busca una sola vez el nodo inicial de cada estado pedido.
+    Los estados cuyo flujo o nodo no existe, o que no tienen template_sid, se omiten.
+    """
+    start_nodes = {}
+    for status in statuses:
+        flow_info = STATUS_TO_FLOW[status]
+        resolved = flow_manager.get_node(flow_info["node_id"])
+        if not resolved or resolved[0].get("name") != flow_info["flow_name"]:
+            print(f"❌ Nodo inicial '{flow_info['node_id']}' no encontrado en el flujo '{flow_info['flow_name']}'.")
+            continue
+        node = resolved[1]
+        if not node["data"].get("template_sid"):
+            print(f"❌ El nodo inicial '{flow_info['node_id']}' no tiene un template_sid.")
+            continue
+        start_nodes[status] = node
+    return start_nodes
+
+
+def needs_recovery_dates(start_nodes: Dict[str, Dict[str, Any]]) -> bool:
+    """Indica si alguna plantilla de la campaña usa {recovery_date}."""
+    return any("{recovery_date}" in node["data"]["label"] for node in start_nodes.values())
+
+
+def build_message(
+    grade_info: Dict[str, Any],
+    start_nodes: Dict[str, Dict[str, Any]],
+    previous_cursor: tuple[int, int],
+    recovery_dates: Dict[int, datetime],
+) -> CampaignMessage | None:
+    """Arma el mensaje para una calificación, o None si su estado no es parte de la campaña."""
+    status = classify_grade(float(grade_info["finalgrade"]))
+    node = start_nodes.get(status)
+    if not node:
+        return None
+
+    recovery_date = recovery_dates.get(grade_info["course_id"])
+    values = {
+        "student_name": grade_info["firstname"],
+        "course_name": grade_info["course_name"],
+        "recovery_date": recovery_date.strftime("%d/%m/%Y") if recovery_date else "a confirmar",
+    }
+    # Variables de la plantilla de Twilio, en el orden declarado en el nodo
+    template_variables = node["data"].get("template_variables") or ["student_name", "course_name"]
+    content_variables = {str(i): values.get(name, "") for i, name in enumerate(template_variables, start=1)}
+
+    # El texto real está en la plantilla de Twilio; guardamos el renderizado como referencia
+    body_for_db = node["data"]["label"].format(**values)
+    return CampaignMessage(
+        key=ledger_key(grade_info),
+        previous_cursor=previous_cursor,
+        status=status,
+        student_name=values["student_name"],
+        course_id=grade_info["course_id"],
+        course_name=values["course_name"],
+        grade_item_id=grade_info["grade_item_id"],
+        node_id=node["id"],
+        template_sid=node["data"]["template_sid"],
+        content_variables=content_variables,
+        body_for_db=body_for_db,
+    )
+
+
+def run_campaign(
+    statuses: Iterable[str],
+    hours_ago: int,
+    recipient: str,
+    rate_per_second: float = settings.CAMPAIGN_RATE_PER_SECOND,
+    burst: int = settings.CAMPAIGN_BURST,
+    workers: int = settings.CAMPAIGN_WORKERS,
+    chunk_size: int = 500,
+) -> Dict[str, int]:
+    """
+    Envía las notificaciones de notas para los estados pedidos.
+    Es incremental: solo lee las notas modificadas después de la marca de agua
+    (timemodified, id) de la corrida anterior; en la primera corrida usa las últimas
+    'hours_ago' horas. Las notas que ya figuran en notification_ledger se omiten.
+    Cada nota se clasifica una sola vez y se envía con la plantilla del nodo inicial del flujo.
+    Los envíos corren en un pool de 'workers' hilos, limitados por un token bucket
+    de 'rate_per_second' mensajes por segundo con ráfagas de hasta 'burst'.
+    Los mensajes enviados se guardan en lotes de 'chunk_size' filas desde el hilo principal.
+    """
+    summary = {"candidates": 0, "sent": 0, "skipped": 0, "failed": 0}
+    start_nodes = resolve_start_nodes(statuses)
+    if not start_nodes:
+        print("❌ Ningún estado de la campaña tiene un flujo válido. Finalizando.")
+        return summary
+
+    chatbot_db = SessionLocalChatbot()
+    # Sesión dedicada al cursor de extracción: queda ocupada mientras dura la campaña
+    moodle_stream_db = SessionLocalMoodleBatch()
+    moodle_db = SessionLocalMoodleBatch()
+    bucket = TokenBucket(rate_per_second, burst)
+    # Mensajes y ledger se guardan por lotes, no con un commit por envío
+    writer = BufferedMessageWriter(max_batch=chunk_size)
+
+    def send(message: CampaignMessage) -> str:
+        bucket.acquire()
+        # Los hilos comparten las conexiones keep-alive del transporte
+        return twilio_transport.send(
+            to=recipient,
+            content_sid=message.template_sid,
+            content_variables=json.dumps(message.content_variables)
+        )
+
+    # Si un envío falla, la marca de agua no avanza más allá de esa nota
+    failed_cursors = []
+    # Marca de agua anterior de cada nota enviada, por si su lote no llega a guardarse
+    sent_cursors: Dict[LedgerKey, tuple] = {}
+
+    def record(future, message: CampaignMessage) -> None:
+        try:
+            future.result()
+        except Exception as e:
+            summary["failed"] += 1
+            failed_cursors.append(message.previous_cursor)
+            print(f"❌ Error al enviar mensaje a {message.student_name} vía Twilio: {e}")
+            return
+        summary["sent"] += 1
+        sent_cursors[message.key] = message.previous_cursor
+        # El registro en el ledger se confirma junto con el mensaje
+        writer.add(MessageCreate(
+            sender_id=settings.TWILIO_FROM_NUMBER,
+            to_id=recipient,
+            message_body=message.body_for_db,
+            direction='outgoing',
+            template_id=message.node_id, # Nodo inicial de la conversación
+            course_id=message.course_id,
+            course_name=message.course_name,
+            grade_item_id=message.grade_item_id
+        ), ledger_entry=(message.key, message.status))
+
+    try:
+        name = cursor_name(start_nodes)
+        cursor = get_sync_cursor(chatbot_db, name)
+        if cursor is None:
+            since = datetime.now() - timedelta(hours=hours_ago)
+            cursor = (int(since.timestamp()), 0)
+
+        # Fechas de recuperatorio por curso, precalculadas por lote
+        with_recovery_dates = needs_recovery_dates(start_nodes)
+        recovery_dates: Dict[int, datetime] = {}
+        known_courses: set[int] = set()
+
+        # Cantidad máxima de envíos pendientes, para no encolar toda la campaña en memoria
+        max_in_flight = workers * 2
+        pending = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="campaign") as executor:
+            # Las notas llegan en lotes por un cursor del lado del servidor
+            for chunk in moodle_queries.iter_course_grades_after(moodle_stream_db, *cursor, chunk_size=chunk_size):
+                print(f"📊 Procesando un lote de {len(chunk)} calificaciones nuevas.")
+                if with_recovery_dates:
+                    # Una sola consulta por lote, solo para los cursos que aún no conocemos
+                    new_courses = {grade_info["course_id"] for grade_info in chunk} - known_courses
+                    if new_courses:
+                        recovery_dates.update(moodle_queries.get_recovery_dates_for_courses(moodle_db, list(new_courses)))
+                        known_courses.update(new_courses)
+
+                messages = []
+                for grade_info in chunk:
+                    message = build_message(grade_info, start_nodes, cursor, recovery_dates)
+                    cursor = (grade_info["timemodified"], grade_info["grade_id"])
+                    if message:
+                        messages.append(message)
+                already_notified = get_notified_keys(chatbot_db, [message.key for message in messages])
+
+                for message in messages:
+                    summary["candidates"] += 1
+                    if message.key in already_notified:
+                        summary["skipped"] += 1
+                        continue
+                    print(f"✉️  Enviando mensaje de '{message.status}' a {message.student_name}...")
+                    pending[executor.submit(send, message)] = message
+
+                    if len(pending) >= max_in_flight:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record(future, pending.pop(future))
+
+            for future in list(pending):
+                record(future, pending.pop(future))
+
+        writer.flush()
+        # Envíos cuyo mensaje y ledger no se pudieron guardar (pendientes o descartados): la marca
+        # de agua no los pasa, así la próxima corrida los vuelve a leer (el ledger evita duplicar lo que sí se guardó)
+        unwritten_cursors = [sent_cursors[entry[0]] for _, entry in writer.pending() + writer.dead_letters() if entry]
+        if unwritten_cursors:
+            print(f"⚠️ {len(unwritten_cursors)} envíos no se pudieron registrar; la marca de agua no los pasa.")
+
+        # Nueva marca de agua: la última nota leída, o la anterior al primer envío fallido o sin registrar
+        held_back = failed_cursors + unwritten_cursors
+        cursor = min(held_back) if held_back else cursor
+        set_sync_cursor(chatbot_db, name, *cursor)
+        chatbot_db.commit()
+    finally:
+        writer.close()
+        chatbot_db.close()
+        moodle_stream_db.close()
+        moodle_db.close()
+
+    print(f"✅ Campaña finalizada: {summary['sent']} enviados, {summary['skipped']} ya notificados, {summary['failed']} con error.")
+    return summary
@@ -0,0 +1,147 @@
+# app/services/inbound_processor.py
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import crud_operations, directory_queries, moodle_queries
+from app.db.fanout import fan_out
+from app.schemas import message as message_schema
+from app.schemas.alert import DashboardAlertCreate
+from app.flows import flow_manager
+from app.services.twilio_transport import twilio_transport
+
+
+def process_inbound_message(chatbot_db: Session, moodle_db: Session, from_number: str, body: str, save_incoming: bool = True) -> str | None:
+    """
+    Procesa un mensaje entrante de WhatsApp: resuelve el flujo, arma la respuesta,
+    la envía por Twilio y la registra. Devuelve el SID del mensaje enviado.
+    Con OUTBOX_ENABLED la respuesta no se envía acá: queda pendiente en el outbox
+    (en la misma transacción) y se devuelve None.
+    Se usa tanto desde el webhook (modo síncrono) como desde la cola de entrada.
+    Todo lo que se escribe (entrante, saliente, alerta, estado) va en una sola transacción.
+    """
+    # 1. El mensaje entrante se guarda junto con la respuesta, al final
+    incoming_message = None
+    if save_incoming:
+        incoming_message = message_schema.MessageCreate(sender_id=from_number, message_body=body, direction='incoming')
+
+    try:
+        reply_text, next_node_id, alert_data = _build_reply(chatbot_db, moodle_db, from_number, body)
+        print(f"Reply text: {reply_text}")
+        outgoing_message = message_schema.MessageCreate(
+            sender_id=settings.TWILIO_FROM_NUMBER,
+            message_body=reply_text,
+            direction='outgoing',
+            to_id=from_number,
+            template_id=next_node_id # Save the next node ID as template_id
+        )
+
+        if settings.OUTBOX_ENABLED:
+            # 3. La respuesta queda en el outbox junto con el resto del turno; la envía el worker
+            crud_operations.record_webhook_turn(chatbot_db, incoming=incoming_message, outgoing=outgoing_message, alert=alert_data, outbox=True)
+            print("✅ Reply queued in outbox.")
+            return None
+
+        # 3. Envía la respuesta por WhatsApp
+        print("Sending reply...")
+        outgoing_sid = twilio_transport.send(to=from_number, body=reply_text)
+        print("✅ Reply sent.")
+    except Exception:
+        # No perdemos el mensaje entrante aunque falle la respuesta
+        if incoming_message:
+            chatbot_db.rollback()
+            crud_operations.record_webhook_turn(chatbot_db, incoming=incoming_message)
+        raise
+
+    # 4. Guarda entrante, saliente, alerta y estado de la conversación en una sola transacción
+    print("Saving messages...")
+    crud_operations.record_webhook_turn(chatbot_db, incoming=incoming_message, outgoing=outgoing_message, alert=alert_data)
+    print("✅ Messages saved.")
+
+    return outgoing_sid
+
+
+def _build_reply(chatbot_db: Session, moodle_db: Session, from_number: str, body: str) -> tuple[str, str | None, DashboardAlertCreate | None]:
+    """Resuelve el alumno y el flujo y devuelve (texto de respuesta, próximo nodo, alerta)."""
+    # 2. Busca al alumno por su número de teléfono en el directorio local
+    print(f"Searching for student with phone: {from_number}")
+    student = directory_queries.get_student_by_phone(chatbot_db, phone_number=from_number)
+    if not student and settings.STUDENT_DIRECTORY_FALLBACK:
+        # Alumno aún no sincronizado: lo buscamos en Moodle
+        student = moodle_queries.get_student_by_phone(moodle_db, phone_number=from_number)
+
+    # --- TEST MODE ---
+    if not student and settings.TEST_MODE_PHONE_NUMBER and from_number == settings.TEST_MODE_PHONE_NUMBER:
+        print(f"--- RUNNING IN TEST MODE FOR NUMBER: {from_number} ---")
+        student = {
+            "moodle_user_id": 999,
+            "full_name": "Test User"
+        }
+    # --- END TEST MODE ---
+
+    print(f"Student found: {student}")
+
+    reply_text = ""
+    next_node_id = None
+    alert_data = None
+
+    if not student:
+        reply_text = "Hola. No hemos podido identificarte en nuestro sistema. Por favor, contacta con administración."
+    else:
+        # The conversation state tells us the current node (primary key lookup).
+        # The course name comes from Moodle in parallel (app/db/fanout.py).
+        results = fan_out({
+            "state": (chatbot_db, crud_operations.get_conversation_state, from_number),
+            "course_name": (moodle_db, moodle_queries.get_course_name_by_id, settings.TARGET_COURSE_ID),
+        })
+        conversation_state = results["state"]
+        current_node_id = conversation_state.node_id if conversation_state else None
+
+        print(f"Current node ID: {current_node_id}")
+
+        # The compiled flow graph resolves the node and the reply in O(1)
+        active_flow = flow_manager.get_node(current_node_id)
+
+        if not active_flow:
+            # Fallback for cases where the conversation starts without a template_id,
+            # or the node is not found in any active flow.
+            # This part might need more sophisticated logic depending on desired behavior.
+            reply_text = "No hemos podido encontrar un flujo de conversación activo. Por favor, contacta a soporte."
+        else:
+            next_node = flow_manager.get_next_node(current_node_id, body)
+
+            if not next_node:
+                reply_text = "Lo siento, no entendí tu respuesta. Por favor, intenta de nuevo o contacta con administración."
+            else:
+                # We have the next node, so we can format the reply
+                student_name = student["full_name"].split(" ")[0]
+                course_name = results["course_name"] or "este curso"
+                recovery_date = "a confirmar"
+                if "{recovery_date}" in next_node["data"]["label"]:
+                    recovery_dates = moodle_queries.get_recovery_dates_for_courses(moodle_db, [settings.TARGET_COURSE_ID])
+                    if settings.TARGET_COURSE_ID in recovery_dates:
+                        recovery_date = recovery_dates[settings.TARGET_COURSE_ID].strftime("%d/%m/%Y")
+
+                try:
+                    reply_text = next_node["data"]["label"].format(
+                        student_name=student_name,
+                        course_name=course_name,
+                        recovery_date=recovery_date
+                    )
+                except KeyError as e:
+                    print(f"KeyError formatting reply: {e}. Using label as is.")
+                    reply_text = next_node["data"]["label"]
+
+                next_node_id = next_node["id"]
+
+                # Check for alert condition (DESAPROBADO_2C)
+                if next_node_id == "DESAPROBADO_2C":
+                    alert_description = f"Student {student['full_name']} ({from_number}) responded 'C' to failed exam follow-up. Needs tutor contact."
+                    alert_data = DashboardAlertCreate(
+                        student_phone=from_number,
+                        alert_type="human_intervention_needed",
+                        description=alert_description
+                    )
+                    print("✅ Dashboard alert prepared for human intervention.")
+
+    return reply_text, next_node_id, alert_data
@@ -0,0 +1,154 @@
+# app/services/inbound_queue.py
+
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.phone import normalize_phone
+from app.db.session import SessionLocalChatbot, SessionLocalMoodle
+from app.services.inbound_processor import process_inbound_message
+
+
+@dataclass
+class InboundJob:
+    from_number: str
+    body: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class InboundQueue:
+    """
+    Cola acotada de mensajes entrantes con un pool fijo de workers.
+    El webhook solo valida, guarda el mensaje crudo y encola; la resolución
+    del flujo, la respuesta y el envío corren en estos hilos.
+    Cada teléfono va siempre a la misma cola (una por worker), así los mensajes
+    de un alumno se procesan de a uno y en orden de llegada; el procesamiento en
+    línea (cola llena o sin fast-ack) toma el mismo lock que ese worker.
+    """
+
+    def __init__(self, workers: int, max_depth: int, latency_window: int = 500):
+        self._workers = workers
+        self._max_depth = max_depth
+        self._queues: list[queue.Queue[InboundJob | None]] = [
+            queue.Queue(maxsize=max(1, max_depth // workers)) for _ in range(workers)
+        ]
+        self._shard_locks = [threading.Lock() for _ in range(workers)]
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        # Latencias (en segundos) de los últimos trabajos: espera en cola y total
+        self._wait_times: deque[float] = deque(maxlen=latency_window)
+        self._total_times: deque[float] = deque(maxlen=latency_window)
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._worker, args=(i,), name=f"inbound-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"✅ Inbound queue started with {self._workers} workers (depth {self._max_depth}).")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Detiene los workers después de vaciar los trabajos pendientes."""
+        for shard_queue in self._queues[:len(self._threads)]:
+            shard_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def _shard(self, from_number: str) -> int:
+        """Cola (y lock) de un teléfono: estable para todas sus variantes de formato."""
+        key = normalize_phone(from_number) or from_number or ""
+        return zlib.crc32(key.encode()) % self._workers
+
+    def submit(self, from_number: str, body: str) -> bool:
+        """Encola un mensaje en la cola de su teléfono. Devuelve False si esa cola está llena."""
+        try:
+            self._queues[self._shard(from_number)].put_nowait(InboundJob(from_number=from_number, body=body))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+    def process_inline(self, chatbot_db: Session, moodle_db: Session, from_number: str, body: str, save_incoming: bool = True) -> str | None:
+        """
+        Procesa un mensaje en el hilo actual, con el mismo lock que el worker de su teléfono,
+        para no cruzarse con otro mensaje del mismo alumno que se esté procesando.
+        """
+        with self._shard_locks[self._shard(from_number)]:
+            return process_inbound_message(chatbot_db, moodle_db, from_number, body, save_incoming)
+
+    def _worker(self, shard: int) -> None:
+        shard_queue = self._queues[shard]
+        while True:
+            job = shard_queue.get()
+            if job is None:
+                shard_queue.task_done()
+                return
+            started_at = time.monotonic()
+            chatbot_db = SessionLocalChatbot()
+            moodle_db = SessionLocalMoodle()
+            ok = True
+            try:
+                with self._shard_locks[shard]:
+                    process_inbound_message(chatbot_db, moodle_db, job.from_number, job.body, save_incoming=False)
+            except Exception as e:
+                ok = False
+                print(f"❌ Inbound worker error for {job.from_number}: {e}")
+            finally:
+                chatbot_db.close()
+                moodle_db.close()
+                shard_queue.task_done()
+            finished_at = time.monotonic()
+            with self._lock:
+                self._wait_times.append(started_at - job.enqueued_at)
+                self._total_times.append(finished_at - job.enqueued_at)
+                if ok:
+                    self._processed += 1
+                else:
+                    self._failed += 1
+
+    def stats(self) -> dict:
+        """Largo de la cola y latencias de procesamiento (ms) de la ventana reciente."""
+        with self._lock:
+            wait_times = sorted(self._wait_times)
+            total_times = sorted(self._total_times)
+            processed, failed, rejected = self._processed, self._failed, self._rejected
+        return {
+            "running": self.running,
+            "workers": self._workers,
+            "queue_length": sum(shard_queue.qsize() for shard_queue in self._queues),
+            "max_depth": self._max_depth,
+            "processed": processed,
+            "failed": failed,
+            "rejected": rejected,
+            "wait_ms": _percentiles(wait_times),
+            "latency_ms": _percentiles(total_times),
+        }
+
+
+def _percentiles(sorted_values: list[float]) -> dict:
+    if not sorted_values:
+        return {"p50": None, "p95": None, "max": None}
+
+    def pick(q: float) -> float:
+        return round(sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] * 1000, 2)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "max": round(sorted_values[-1] * 1000, 2)}
+
+
+inbound_queue = InboundQueue(workers=settings.INBOUND_WORKERS, max_depth=settings.INBOUND_QUEUE_DEPTH)
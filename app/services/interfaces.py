@@ -1,5 +1,6 @@
 # app/services/interfaces.py
 
+import asyncio
 from abc import ABC, abstractmethod
 
 # Principio de Segregación de Interfaces (I) y Dependencia (D)
@@ -15,4 +16,8 @@ class IWhatsAppService(ABC):
     @abstractmethod
     def send_message(self, to: str, body: str) -> bool:
         """Envía un mensaje de WhatsApp."""
-        pass
\ No newline at end of file
+        pass
+
+    async def send_message_async(self, to: str, body: str) -> bool:
+        """Versión asíncrona de send_message. Por defecto corre send_message en un hilo."""
+        return await asyncio.to_thread(self.send_message, to, body)
@@ -0,0 +1,48 @@
+# app/services/kpi_snapshot.py
+
+from functools import partial
+from typing import Dict, Any, Optional
+
+from app.core.config import settings
+from app.crud import kpi_queries
+from app.db.session import SessionLocalChatbot, SessionLocalMoodleAnalytics
+from app.services.periodic import PeriodicTask
+
+
+def refresh_kpis(full: bool = False, max_age_seconds: float | None = None, wait_seconds: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    Recalcula el snapshot de KPIs de Moodle con sesiones propias. Devuelve el snapshot,
+    o None si no hizo falta: otro proceso lo está recalculando (y no se liberó en
+    'wait_seconds') o tiene menos de 'max_age_seconds' de antigüedad.
+    Con varios workers de la app, así corre un solo recálculo por intervalo.
+    """
+    lock_db = SessionLocalChatbot()
+    try:
+        with kpi_queries.snapshot_refresh_lock(lock_db, wait_seconds) as acquired:
+            if not acquired:
+                print("ℹ️ Otro proceso está recalculando el snapshot de KPIs; se omite.")
+                return None
+
+            moodle_db = SessionLocalMoodleAnalytics()
+            chatbot_db = SessionLocalChatbot()
+            try:
+                # Se mira bajo el lock: otro proceso pudo haberlo recalculado mientras esperábamos
+                age = kpi_queries.get_snapshot_age_seconds(chatbot_db)
+                if max_age_seconds is not None and age is not None and age < max_age_seconds:
+                    return None
+                return kpi_queries.refresh_kpi_snapshot(moodle_db, chatbot_db, full=full)
+            except Exception:
+                chatbot_db.rollback()
+                raise
+            finally:
+                moodle_db.close()
+                chatbot_db.close()
+    finally:
+        lock_db.close()
+
+
+kpi_snapshot_refresher = PeriodicTask(
+    "kpi-snapshot",
+    settings.KPI_SNAPSHOT_REFRESH_SECONDS,
+    partial(refresh_kpis, max_age_seconds=settings.KPI_SNAPSHOT_REFRESH_SECONDS),
+)
@@ -0,0 +1,21 @@
+# app/services/message_stats.py
+
+from app.core.config import settings
+from app.crud.messages_queries import refresh_message_daily_stats
+from app.db.session import SessionLocalChatbot
+from app.services.periodic import PeriodicTask
+
+
+def refresh_message_stats() -> int:
+    """Actualiza message_daily_stats con su propia sesión. Devuelve la nueva marca de agua."""
+    db = SessionLocalChatbot()
+    try:
+        return refresh_message_daily_stats(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+message_stats_refresher = PeriodicTask("message-stats", settings.MESSAGE_STATS_REFRESH_SECONDS, refresh_message_stats)
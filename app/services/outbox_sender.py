@@ -0,0 +1,146 @@
+# app/services/outbox_sender.py
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import outbox_queries
+from app.db.session import SessionLocalChatbot
+from app.services.twilio_transport import twilio_transport
+
+# Margen del reclamo para marcar el resultado y para la demora del transporte
+LEASE_MARGIN_SECONDS = 30
+
+
+class LeaseExpired(Exception):
+    """El reclamo del lote vence antes de que el envío pueda terminar: no se envía."""
+
+
+class OutboxSender:
+    """
+    Worker que vacía outbound_messages: reclama lotes con FOR UPDATE SKIP LOCKED,
+    los envía por el transporte de Twilio y marca el resultado.
+    Se pueden correr varios en paralelo (hilos, procesos o máquinas).
+    El reclamo dura lo que tarda el lote en el peor caso (una tanda de 'concurrency'
+    envíos por cada timeout de Twilio, más un margen), y un envío que ya no llegaría
+    a terminar dentro del reclamo no arranca: el mensaje se libera sin enviarse, así
+    nunca lo manda también otro worker que lo reclamó de nuevo.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocalChatbot,
+        batch_size: int = 50,
+        concurrency: int = 8,
+        poll_interval: float = 1.0,
+        lease_seconds: float | None = None,
+        max_attempts: int = 5,
+        backoff_seconds: float = 5.0,
+        send_timeout: float = settings.TWILIO_TIMEOUT_SECONDS,
+    ):
+        self._session_factory = session_factory
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._poll_interval = poll_interval
+        self._send_timeout = send_timeout
+        rounds = math.ceil(batch_size / concurrency)
+        minimum_lease = send_timeout + LEASE_MARGIN_SECONDS
+        self._lease_seconds = max(lease_seconds or rounds * send_timeout + LEASE_MARGIN_SECONDS, minimum_lease)
+        self._max_attempts = max_attempts
+        self._backoff_seconds = backoff_seconds
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _send(self, outbound: Dict[str, Any], start_deadline: float) -> str:
+        if time.monotonic() > start_deadline:
+            raise LeaseExpired()
+        return twilio_transport.send(
+            to=outbound["to_id"],
+            body=outbound["body"],
+            content_sid=outbound["content_sid"],
+            content_variables=outbound["content_variables"],
+        )
+
+    def drain_once(self) -> int:
+        """Reclama y envía un lote. Devuelve la cantidad de mensajes reclamados."""
+        db = self._session_factory()
+        try:
+            # Se mide antes de reclamar: el reclamo vence, a lo sumo, lease_seconds después
+            claimed_at = time.monotonic()
+            batch = outbox_queries.claim_batch(db, self._batch_size, self._lease_seconds, self._max_attempts)
+            if not batch:
+                return 0
+            # Último momento para arrancar un envío que termine (con margen) antes del vencimiento
+            start_deadline = claimed_at + self._lease_seconds - LEASE_MARGIN_SECONDS - self._send_timeout
+
+            executor = self._executor or ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="outbox")
+            futures = [(outbound, executor.submit(self._send, outbound, start_deadline)) for outbound in batch]
+            sent, released = [], []
+            for outbound, future in futures:
+                try:
+                    sent.append((outbound["id"], future.result()))
+                except LeaseExpired:
+                    released.append(outbound["id"])
+                except Exception as e:
+                    status = outbox_queries.mark_failed(
+                        db, outbound["id"], outbound["attempts"], str(e), self._max_attempts, self._backoff_seconds
+                    )
+                    print(f"❌ Outbox: error al enviar el mensaje {outbound['id']} a {outbound['to_id']} ({status}): {e}")
+            outbox_queries.mark_sent(db, sent)
+            outbox_queries.release(db, released)
+            if released:
+                print(f"⚠️ Outbox: {len(released)} mensajes no alcanzaron a enviarse dentro del reclamo; se liberan.")
+            db.commit()
+            if executor is not self._executor:
+                executor.shutdown()
+            return len(batch)
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Outbox: error al procesar un lote: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def run(self) -> None:
+        """Procesa lotes hasta que se llame a stop(). Si la cola está vacía, espera poll_interval."""
+        self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="outbox")
+        try:
+            while not self._stop.is_set():
+                if self.drain_once() < self._batch_size:
+                    self._stop.wait(self._poll_interval)
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+
+    def start(self) -> None:
+        """Corre el worker en un hilo de fondo."""
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="outbox-sender", daemon=True)
+        self._thread.start()
+        print(f"✅ Outbox sender started (batch {self._batch_size}, concurrency {self._concurrency}).")
+
+    def stop(self, timeout: float = 30.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+
+outbox_sender = OutboxSender(
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    concurrency=settings.OUTBOX_CONCURRENCY,
+    poll_interval=settings.OUTBOX_POLL_SECONDS,
+    max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+)
@@ -0,0 +1,43 @@
+# app/services/periodic.py
+
+import threading
+from typing import Callable
+
+
+class PeriodicTask:
+    """Corre una función cada 'interval' segundos en un hilo de fondo."""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], object]):
+        self.name = name
+        self.interval = interval
+        self._func = func
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        print(f"✅ Periodic task '{self.name}' started (every {self.interval:g}s).")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        # La primera corrida es inmediata, después cada 'interval' segundos
+        while True:
+            try:
+                self._func()
+            except Exception as e:
+                print(f"❌ Periodic task '{self.name}' failed: {e}")
+            if self._stop.wait(self.interval):
+                return
@@ -0,0 +1,138 @@
+# app/services/risk_scoring.py
+
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.crud import directory_queries, moodle_queries
+
+# Peso de cada factor en el puntaje de riesgo (suman 1)
+RISK_WEIGHTS = {
+    "fail_streak": 0.30,
+    "absence_rate": 0.25,
+    "fail_rate": 0.20,
+    "inactivity": 0.15,
+    "trend": 0.10,
+}
+# Valores a partir de los cuales cada factor cuenta completo
+FAIL_STREAK_CAP = 3          # exámenes seguidos sin aprobar
+INACTIVITY_CAP_DAYS = 30     # días desde el último examen
+TREND_CAP = 1.0              # puntos de nota perdidos por examen
+
+
+def score_students(columns: Dict[str, list], now: float | None = None) -> Dict[str, np.ndarray]:
+    """
+    Calcula las variables de riesgo de todos los alumnos a la vez, con operaciones
+    vectorizadas sobre las columnas de get_quiz_grade_columns (sin recorrer alumnos):
+    racha actual de exámenes sin aprobar, tasa de ausentes (sin nota o nota 0),
+    tasa de desaprobados, tendencia (pendiente de la nota por examen), nota promedio
+    y días desde el último examen. Devuelve un arreglo por variable, uno por alumno,
+    más 'score' (0 a 1, mayor es más riesgo).
+    """
+    now = time.time() if now is None else now
+    user_id = np.asarray(columns["user_id"], dtype=np.int64)
+    grade = np.asarray(columns["finalgrade"], dtype=float) # None -> NaN
+    modified = np.nan_to_num(np.asarray(columns["timemodified"], dtype=float))
+
+    # Orden cronológico dentro de cada alumno
+    order = np.lexsort((modified, user_id))
+    user_id, grade, modified = user_id[order], grade[order], modified[order]
+
+    users, start, attempts = np.unique(user_id, return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(users)), attempts)
+    position = np.arange(len(user_id)) - start[group]
+
+    absent = np.isnan(grade) | (grade == 0)
+    passed = ~absent & (grade >= moodle_queries.PASSING_GRADE)
+    failed = ~absent & ~passed
+
+    # Racha actual: exámenes desde el último aprobado
+    last_passed = np.full(len(users), -1)
+    np.maximum.at(last_passed, group[passed], position[passed])
+    fail_streak = attempts - 1 - last_passed
+
+    absence_rate = np.bincount(group, weights=absent, minlength=len(users)) / attempts
+    fail_rate = np.bincount(group, weights=failed, minlength=len(users)) / attempts
+
+    # Pendiente de mínimos cuadrados de la nota (ausente = 0) contra el orden del examen
+    y = np.nan_to_num(grade)
+    x = position.astype(float)
+    sum_x = np.bincount(group, weights=x, minlength=len(users))
+    sum_y = np.bincount(group, weights=y, minlength=len(users))
+    sum_xy = np.bincount(group, weights=x * y, minlength=len(users))
+    sum_xx = np.bincount(group, weights=x * x, minlength=len(users))
+    denominator = attempts * sum_xx - sum_x ** 2
+    trend = np.divide(attempts * sum_xy - sum_x * sum_y, denominator, out=np.zeros(len(users)), where=denominator > 0)
+
+    days_since_last = np.maximum(now - modified[start + attempts - 1], 0) / 86400
+
+    score = (
+        RISK_WEIGHTS["fail_streak"] * np.minimum(fail_streak / FAIL_STREAK_CAP, 1)
+        + RISK_WEIGHTS["absence_rate"] * absence_rate
+        + RISK_WEIGHTS["fail_rate"] * fail_rate
+        + RISK_WEIGHTS["inactivity"] * np.minimum(days_since_last / INACTIVITY_CAP_DAYS, 1)
+        + RISK_WEIGHTS["trend"] * np.clip(-trend / TREND_CAP, 0, 1)
+    )
+
+    return {
+        "user_id": users,
+        "attempts": attempts,
+        "fail_streak": fail_streak,
+        "absence_rate": absence_rate,
+        "fail_rate": fail_rate,
+        "trend": trend,
+        "mean_grade": sum_y / attempts,
+        "days_since_last": days_since_last,
+        "score": score,
+    }
+
+
+def top_at_risk(features: Dict[str, np.ndarray], limit: int, min_score: float = 0.0) -> List[Dict[str, Any]]:
+    """Los 'limit' alumnos con mayor puntaje (>= min_score), de mayor a menor, como diccionarios."""
+    candidates = np.flatnonzero(features["score"] >= min_score)
+    if len(candidates) > limit:
+        # Selección parcial: solo se ordenan los 'limit' mejores
+        candidates = candidates[np.argpartition(-features["score"][candidates], limit - 1)[:limit]]
+    ranked = candidates[np.argsort(-features["score"][candidates], kind="stable")]
+
+    return [
+        {
+            "moodle_user_id": int(features["user_id"][i]),
+            "score": round(float(features["score"][i]), 3),
+            "attempts": int(features["attempts"][i]),
+            "fail_streak": int(features["fail_streak"][i]),
+            "absence_rate": round(float(features["absence_rate"][i]), 3),
+            "fail_rate": round(float(features["fail_rate"][i]), 3),
+            "trend": round(float(features["trend"][i]), 3),
+            "mean_grade": round(float(features["mean_grade"][i]), 2),
+            "days_since_last": round(float(features["days_since_last"][i]), 1),
+        }
+        for i in ranked
+    ]
+
+
+def get_at_risk_students(
+    moodle_db: Session,
+    chatbot_db: Session,
+    course_ids: List[int],
+    limit: int = 50,
+    min_score: float = 0.0,
+) -> List[Dict[str, Any]]:
+    """
+    Ranking de alumnos en riesgo de una cohorte (uno o más cursos): una sola
+    extracción de notas de cuestionarios en Moodle, scoring vectorizado y una
+    consulta IN al directorio local para el nombre y el WhatsApp de cada alumno.
+    """
+    columns = moodle_queries.get_quiz_grade_columns(moodle_db, course_ids)
+    if not columns["user_id"]:
+        return []
+
+    ranked = top_at_risk(score_students(columns), limit, min_score)
+    students = directory_queries.get_students_by_moodle_ids(chatbot_db, [row["moodle_user_id"] for row in ranked])
+    for row in ranked:
+        student = students.get(row["moodle_user_id"], {})
+        row["full_name"] = student.get("full_name")
+        row["phone"] = student.get("phone")
+    return ranked
@@ -0,0 +1,194 @@
+# app/services/twilio_transport.py
+
+import asyncio
+import itertools
+import threading
+import time
+from typing import Dict, Any
+
+import httpx
+
+from app.core.config import settings
+from .interfaces import IWhatsAppService
+
+# Cada cuánto reintenta un envío asíncrono cuando se llegó al tope de envíos en curso
+IN_FLIGHT_POLL_SECONDS = 0.01
+
+
+class TwilioSendError(Exception):
+    """Error devuelto por la API de mensajes de Twilio."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"Twilio respondió {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class TwilioTransport(IWhatsAppService):
+    """
+    Envío de mensajes a la API REST de Twilio sobre conexiones HTTP reutilizables.
+    Tiene un cliente síncrono (para hilos: campañas, cola de entrada) y uno asíncrono
+    (para los endpoints), ambos con pool de conexiones keep-alive y timeouts por
+    pedido. El tope de envíos en curso ('max_in_flight') es uno solo para los dos.
+    """
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        from_number: str,
+        base_url: str = "https://api.twilio.com",
+        max_connections: int = 20,
+        max_in_flight: int = 20,
+        timeout: float = 10.0,
+        transport: httpx.BaseTransport | None = None,
+        async_transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.from_number = from_number
+        self._url = f"{base_url}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self._auth = (account_sid, auth_token)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = httpx.Timeout(timeout)
+        self._transport = transport
+        self._async_transport = async_transport
+        # Compartido por el cliente síncrono y el asíncrono
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._client: httpx.Client | None = None
+        # El cliente asíncrono pertenece al event loop que lo creó
+        self._async_client: httpx.AsyncClient | None = None
+
+    def _form(self, to: str, body: str | None, content_sid: str | None, content_variables: str | None) -> Dict[str, str]:
+        form = {"From": self.from_number, "To": to}
+        if body is not None:
+            form["Body"] = body
+        if content_sid:
+            form["ContentSid"] = content_sid
+        if content_variables:
+            form["ContentVariables"] = content_variables
+        return form
+
+    @staticmethod
+    def _sid(response: httpx.Response) -> str:
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("message", response.text)
+            except ValueError:
+                detail = response.text
+            raise TwilioSendError(response.status_code, detail)
+        return response.json()["sid"]
+
+    def _get_client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(auth=self._auth, limits=self._limits, timeout=self._timeout, transport=self._transport)
+            return self._client
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(auth=self._auth, limits=self._limits, timeout=self._timeout, transport=self._async_transport)
+        return self._async_client
+
+    async def _acquire_in_flight(self) -> None:
+        # Sin bloquear el event loop (ni dejar un hilo esperando si se cancela el pedido):
+        # si no hay lugar, se vuelve a probar cada IN_FLIGHT_POLL_SECONDS
+        while not self._in_flight.acquire(blocking=False):
+            await asyncio.sleep(IN_FLIGHT_POLL_SECONDS)
+
+    def send(self, to: str, body: str | None = None, content_sid: str | None = None, content_variables: str | None = None) -> str:
+        """Envía un mensaje (texto o plantilla) y devuelve su SID. Bloquea el hilo actual."""
+        client = self._get_client()
+        with self._in_flight:
+            response = client.post(self._url, data=self._form(to, body, content_sid, content_variables))
+        return self._sid(response)
+
+    async def send_async(self, to: str, body: str | None = None, content_sid: str | None = None, content_variables: str | None = None) -> str:
+        """Como send(), pero sin ocupar un hilo mientras espera a Twilio."""
+        client = self._get_async_client()
+        await self._acquire_in_flight()
+        try:
+            response = await client.post(self._url, data=self._form(to, body, content_sid, content_variables))
+        finally:
+            self._in_flight.release()
+        return self._sid(response)
+
+    def send_message(self, to: str, body: str) -> bool:
+        try:
+            self.send(to, body=body)
+            return True
+        except (httpx.HTTPError, TwilioSendError) as e:
+            print(f"Error connecting to Twilio API: {e}")
+            return False
+
+    async def send_message_async(self, to: str, body: str) -> bool:
+        try:
+            await self.send_async(to, body=body)
+            return True
+        except (httpx.HTTPError, TwilioSendError) as e:
+            print(f"Error connecting to Twilio API: {e}")
+            return False
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+class FakeTwilioBackend:
+    """
+    Backend local que imita la API de mensajes de Twilio (sin red).
+    Responde cada envío con un SID falso después de 'latency' segundos,
+    para medir el throughput del transporte sin usar la API real.
+    """
+
+    def __init__(self, latency: float = 0.15):
+        self.latency = latency
+        self._counter = itertools.count(1)
+
+    def _response(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "POST" or not request.url.path.endswith("/Messages.json"):
+            return httpx.Response(404, json={"message": "Not found"})
+        return httpx.Response(201, json={"sid": f"SMfake{next(self._counter):026d}", "status": "queued"})
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        time.sleep(self.latency)
+        return self._response(request)
+
+    async def handle_async(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+        return self._response(request)
+
+    def transports(self) -> Dict[str, Any]:
+        """Argumentos 'transport' y 'async_transport' para TwilioTransport."""
+        return {
+            "transport": httpx.MockTransport(self.handle),
+            "async_transport": httpx.MockTransport(self.handle_async),
+        }
+
+
+def build_transport(**overrides) -> TwilioTransport:
+    """Crea el transporte según la configuración (TWILIO_TRANSPORT='twilio' o 'fake')."""
+    options = {
+        "account_sid": settings.TWILIO_ACCOUNT_SID,
+        "auth_token": settings.TWILIO_AUTH_TOKEN,
+        "from_number": settings.TWILIO_FROM_NUMBER,
+        "base_url": settings.TWILIO_API_BASE_URL,
+        "max_connections": settings.TWILIO_MAX_CONNECTIONS,
+        "max_in_flight": settings.TWILIO_MAX_IN_FLIGHT,
+        "timeout": settings.TWILIO_TIMEOUT_SECONDS,
+    }
+    if settings.TWILIO_TRANSPORT == "fake":
+        print("⚠️ TWILIO_TRANSPORT=fake: los mensajes no salen a Twilio.")
+        options.update(FakeTwilioBackend(settings.TWILIO_FAKE_LATENCY_MS / 1000).transports())
+    options.update(overrides)
+    return TwilioTransport(**options)
+
+
+# Transporte compartido por routers, cola de entrada y campañas
+twilio_transport = build_transport()
@@ -0,0 +1,31 @@
+# scripts/add_search_indexes.py
+
+import sys
+import os
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import inspect
+
+from app.db.session import engine_chatbot
+from app.models.message import Message, StudentDirectory
+
+def main():
+    """
+    Crea en las tablas existentes los índices que usa la búsqueda de mensajes:
+    messages.timestamp y los nombres del directorio de alumnos.
+    (create_all no agrega índices a tablas que ya existen.) Se puede volver a correr.
+    """
+    inspector = inspect(engine_chatbot)
+    for model in (Message, StudentDirectory):
+        existing = {index["name"] for index in inspector.get_indexes(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if index.name in existing:
+                continue
+            print(f"➕ Creando el índice {index.name}...")
+            index.create(bind=engine_chatbot)
+    print("✅ Índices al día.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# scripts/backfill_conversation_state.py
+
+import sys
+import os
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db.session import SessionLocalChatbot
+from app.crud.crud_operations import backfill_conversation_states
+
+def main():
+    """
+    Construye la tabla conversation_states a partir del historial de messages.
+    Se corre una vez al desplegar; luego el estado se mantiene con cada mensaje saliente.
+    """
+    print("🤖 Reconstruyendo el estado de las conversaciones...")
+    db = SessionLocalChatbot()
+    try:
+        total = backfill_conversation_states(db)
+        print(f"✅ {total} conversaciones actualizadas.")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error reconstruyendo el estado: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
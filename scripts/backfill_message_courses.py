@@ -0,0 +1,52 @@
+# scripts/backfill_message_courses.py
+
+import sys
+import os
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import inspect, text
+
+from app.db.session import SessionLocalChatbot, SessionLocalMoodleBatch, engine_chatbot
+from app.crud import moodle_queries
+from app.crud.crud_operations import backfill_message_courses
+
+# Columnas nuevas de messages (create_all no agrega columnas a tablas existentes)
+NEW_COLUMNS = {
+    "course_id": "INT NULL",
+    "course_name": "VARCHAR(255) NULL",
+    "grade_item_id": "INT NULL",
+}
+
+def add_missing_columns():
+    existing = {column["name"] for column in inspect(engine_chatbot).get_columns("messages")}
+    with engine_chatbot.begin() as connection:
+        for name, definition in NEW_COLUMNS.items():
+            if name not in existing:
+                print(f"➕ Agregando la columna messages.{name}...")
+                connection.execute(text(f"ALTER TABLE messages ADD COLUMN {name} {definition}"))
+
+def main():
+    """
+    Agrega a messages las columnas del curso de cada notificación y las completa
+    en los mensajes viejos a partir del texto enviado. Se corre una sola vez;
+    las campañas ya guardan el curso al enviar.
+    """
+    add_missing_columns()
+
+    print("🤖 Completando el curso de las notificaciones anteriores...")
+    db = SessionLocalChatbot()
+    moodle_db = SessionLocalMoodleBatch()
+    try:
+        total = backfill_message_courses(db, resolve_course_id=lambda name: moodle_queries.get_course_id_by_name(moodle_db, name))
+        print(f"✅ {total} mensajes actualizados.")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error completando los cursos: {e}")
+    finally:
+        db.close()
+        moodle_db.close()
+
+if __name__ == "__main__":
+    main()
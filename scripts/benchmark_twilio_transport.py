@@ -0,0 +1,56 @@
+# scripts/benchmark_twilio_transport.py
+
+import sys
+import os
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.twilio_transport import FakeTwilioBackend, build_transport
+
+def report(label: str, total: int, elapsed: float) -> None:
+    print(f"📊 {label}: {total} mensajes en {elapsed:.2f}s ({total / elapsed:.1f} msg/s)")
+
+async def run_async(transport, total: int) -> float:
+    started_at = time.perf_counter()
+    await asyncio.gather(*(transport.send_async(to="whatsapp:+5490000000000", body=f"Mensaje {i}") for i in range(total)))
+    elapsed = time.perf_counter() - started_at
+    await transport.aclose()
+    return elapsed
+
+def run_threads(transport, total: int, workers: int) -> float:
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda i: transport.send(to="whatsapp:+5490000000000", body=f"Mensaje {i}"), range(total)))
+    elapsed = time.perf_counter() - started_at
+    transport.close()
+    return elapsed
+
+def main(argv=None):
+    """
+    Mide el throughput del transporte de Twilio contra el backend local falso
+    (no envía nada a la API real). Compara el cliente asíncrono con el síncrono en hilos.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark del transporte de salida de Twilio contra un backend local.")
+    parser.add_argument("--messages", type=int, default=500, help="Cantidad de mensajes a enviar.")
+    parser.add_argument("--latency-ms", type=int, default=150, help="Latencia simulada de la API, en milisegundos.")
+    parser.add_argument("--in-flight", type=int, default=20, help="Máximo de envíos en curso.")
+    parser.add_argument("--workers", type=int, default=8, help="Hilos para la prueba síncrona.")
+    args = parser.parse_args(argv)
+
+    print(f"🤖 Enviando {args.messages} mensajes a un backend falso con {args.latency_ms} ms de latencia...")
+    options = {"max_connections": args.in_flight, "max_in_flight": args.in_flight}
+
+    backend = FakeTwilioBackend(args.latency_ms / 1000)
+    transport = build_transport(**options, **backend.transports())
+    report(f"async (hasta {args.in_flight} en curso)", args.messages, asyncio.run(run_async(transport, args.messages)))
+
+    transport = build_transport(**options, **backend.transports())
+    report(f"sync ({args.workers} hilos)", args.messages, run_threads(transport, args.messages, args.workers))
+
+if __name__ == "__main__":
+    main()
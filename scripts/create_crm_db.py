@@ -27,6 +27,15 @@ def create_crm_tables():
     # - Student
     # - CaseAction
     # - ActionNote
+    # - DashboardAlert
+    # - StudentDirectory
+    # - SyncCursor
+    # - ConversationState
+    # - NotificationLedger
+    # - OutboundMessage
+    # - MessageDailyStat
+    # - CourseGradeStat
+    # - KpiSnapshot
     CrmBase.metadata.create_all(bind=engine_chatbot)
     print("CRM tables created successfully (if they didn't exist already).")
 
@@ -0,0 +1,48 @@
+# scripts/migrate_counterparty_phone.py
+
+import sys
+import os
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import inspect, text
+
+from app.db.session import SessionLocalChatbot, engine_chatbot
+from app.crud.crud_operations import backfill_counterparty_phones
+
+INDEX_NAME = "ix_messages_counterparty_timestamp"
+
+def add_column_and_index():
+    inspector = inspect(engine_chatbot)
+    columns = {column["name"] for column in inspector.get_columns("messages")}
+    indexes = {index["name"] for index in inspector.get_indexes("messages")}
+    with engine_chatbot.begin() as connection:
+        if "counterparty_phone" not in columns:
+            print("➕ Agregando la columna messages.counterparty_phone...")
+            connection.execute(text("ALTER TABLE messages ADD COLUMN counterparty_phone VARCHAR(20) NULL"))
+        if INDEX_NAME not in indexes:
+            print(f"➕ Creando el índice {INDEX_NAME}...")
+            connection.execute(text(f"CREATE INDEX {INDEX_NAME} ON messages (counterparty_phone, timestamp)"))
+
+def main():
+    """
+    Agrega messages.counterparty_phone (teléfono normalizado del alumno) con su índice
+    (counterparty_phone, timestamp) y lo completa en los mensajes existentes.
+    Se puede volver a correr: solo completa los mensajes que no lo tienen.
+    """
+    add_column_and_index()
+
+    print("🤖 Completando counterparty_phone en los mensajes existentes...")
+    db = SessionLocalChatbot()
+    try:
+        total = backfill_counterparty_phones(db)
+        print(f"✅ {total} mensajes actualizados.")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error completando counterparty_phone: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# scripts/refresh_kpi_snapshot.py
+
+import sys
+import os
+import argparse
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.kpi_snapshot import refresh_kpis
+
+# Segundos que espera si otro proceso está recalculando el snapshot
+SCRIPT_LOCK_WAIT_SECONDS = 600
+
+def main(argv=None):
+    """
+    Recalcula el snapshot de KPIs de Moodle (kpi_snapshot) que lee /api/kpis.
+    Solo recuenta los cursos con notas modificadas desde la última corrida;
+    con --full recalcula todos (p. ej. después de borrar cursos o notas en Moodle).
+    """
+    parser = argparse.ArgumentParser(description="Recalcula el snapshot de KPIs de Moodle.")
+    parser.add_argument("--full", action="store_true", help="Recalcula todos los cursos, no solo los modificados.")
+    args = parser.parse_args(argv)
+
+    print("🤖 Actualizando kpi_snapshot...")
+    try:
+        # Si la app lo está recalculando, espera a que termine y recalcula igual
+        snapshot = refresh_kpis(full=args.full, wait_seconds=SCRIPT_LOCK_WAIT_SECONDS)
+        if snapshot is None:
+            print("⚠️ Otro proceso sigue recalculando el snapshot; vuelva a intentarlo más tarde.")
+            return
+        print(f"✅ Snapshot actualizado: {snapshot['approved']} aprobados, {snapshot['disapproved']} desaprobados, {snapshot['total_contacted']} usuarios.")
+    except Exception as e:
+        print(f"❌ Error actualizando el snapshot: {e}")
+
+if __name__ == "__main__":
+    main()
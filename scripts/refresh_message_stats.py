@@ -0,0 +1,24 @@
+# scripts/refresh_message_stats.py
+
+import sys
+import os
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.message_stats import refresh_message_stats
+
+def main():
+    """
+    Actualiza el rollup diario de mensajes (message_daily_stats) desde su marca de agua.
+    La primera corrida procesa todo el historial por lotes; después es incremental.
+    """
+    print("🤖 Actualizando message_daily_stats...")
+    try:
+        last_id = refresh_message_stats()
+        print(f"✅ Rollup actualizado hasta el mensaje {last_id}.")
+    except Exception as e:
+        print(f"❌ Error actualizando el rollup: {e}")
+
+if __name__ == "__main__":
+    main()
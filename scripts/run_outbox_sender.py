@@ -0,0 +1,41 @@
+# scripts/run_outbox_sender.py
+
+import sys
+import os
+import argparse
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.config import settings
+from app.services.outbox_sender import OutboxSender
+
+def main(argv=None):
+    """
+    Worker dedicado del outbox: envía a Twilio los mensajes pendientes de outbound_messages.
+    Se pueden correr varias instancias en paralelo; cada una reclama lotes distintos.
+    """
+    parser = argparse.ArgumentParser(description="Envía los mensajes pendientes del outbox.")
+    parser.add_argument("--batch-size", type=int, default=settings.OUTBOX_BATCH_SIZE, help="Mensajes reclamados por lote.")
+    parser.add_argument("--concurrency", type=int, default=settings.OUTBOX_CONCURRENCY, help="Envíos concurrentes por lote.")
+    parser.add_argument("--once", action="store_true", help="Procesa un solo lote y termina.")
+    args = parser.parse_args(argv)
+
+    sender = OutboxSender(
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        poll_interval=settings.OUTBOX_POLL_SECONDS,
+        max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+    )
+    if args.once:
+        print(f"✅ {sender.drain_once()} mensajes procesados.")
+        return
+
+    print(f"🤖 Enviando mensajes del outbox (lotes de {args.batch_size}, {args.concurrency} concurrentes). Ctrl+C para salir.")
+    try:
+        sender.run()
+    except KeyboardInterrupt:
+        print("👋 Worker del outbox detenido.")
+
+if __name__ == "__main__":
+    main()
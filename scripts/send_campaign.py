@@ -0,0 +1,41 @@
+# scripts/send_campaign.py
+
+import sys
+import os
+import argparse
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.config import settings
+from app.services.campaigns import STATUS_TO_FLOW, run_campaign
+
+def main(argv=None, default_statuses=None, default_hours=24):
+    parser = argparse.ArgumentParser(description="Envía notificaciones de notas (aprobados, desaprobados y ausentes).")
+    parser.add_argument("--status", nargs="+", choices=sorted(STATUS_TO_FLOW), default=default_statuses or sorted(STATUS_TO_FLOW),
+                        help="Estados a notificar (por defecto, todos).")
+    parser.add_argument("--hours", type=int, default=default_hours, help="Ventana de notas de la primera corrida, en horas (luego se continúa desde la marca de agua).")
+    parser.add_argument("--rate", type=float, default=settings.CAMPAIGN_RATE_PER_SECOND, help="Mensajes por segundo.")
+    parser.add_argument("--burst", type=int, default=settings.CAMPAIGN_BURST, help="Ráfaga máxima de mensajes.")
+    parser.add_argument("--workers", type=int, default=settings.CAMPAIGN_WORKERS, help="Hilos de envío concurrentes.")
+    args = parser.parse_args(argv)
+
+    print(f"🤖 Iniciando campaña de notificación para: {', '.join(args.status)}")
+
+    TEST_PHONE_NUMBER = settings.TEST_PHONE_NUMBER
+    if not TEST_PHONE_NUMBER:
+        print("❌ La variable de entorno TEST_PHONE_NUMBER no está configurada. Saliendo.")
+        return
+    print(f"🔒 MODO SEGURO: Todos los mensajes se enviarán a {TEST_PHONE_NUMBER}")
+
+    run_campaign(
+        statuses=args.status,
+        hours_ago=args.hours,
+        recipient=TEST_PHONE_NUMBER,
+        rate_per_second=args.rate,
+        burst=args.burst,
+        workers=args.workers,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# scripts/sync_student_directory.py
+
+import sys
+import os
+
+# Añadimos la ruta raíz del proyecto al path de Python
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db.session import SessionLocalChatbot, SessionLocalMoodleBatch
+from app.crud.directory_queries import sync_student_directory
+
+def main():
+    """
+    Sincroniza el directorio local de alumnos con mdl_user.
+    Es incremental: solo trae usuarios modificados desde la última corrida,
+    así que puede programarse con cron cada pocos minutos.
+    """
+    print("🤖 Sincronizando directorio de alumnos desde Moodle...")
+    chatbot_db = SessionLocalChatbot()
+    moodle_db = SessionLocalMoodleBatch()
+    try:
+        processed = sync_student_directory(moodle_db, chatbot_db)
+        print(f"✅ {processed} usuarios de Moodle procesados.")
+    except Exception as e:
+        chatbot_db.rollback()
+        print(f"❌ Error sincronizando el directorio: {e}")
+    finally:
+        chatbot_db.close()
+        moodle_db.close()
+
+if __name__ == "__main__":
+    main()